@@ -0,0 +1,226 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from statistics import median
+from sys import argv
+import utils as u
+import subprocess
+import tracemalloc
+import platform
+import tempfile
+import warnings
+import forecast
+import random
+import json
+import math
+import time
+import fhm
+import sys
+import os
+
+
+# Times and memory profiles the parse and print hot paths against synthetic
+# FeatureServer fixtures at 1x, 100x and 10000x the real history, report as
+# JSON to compare across commits:
+#   $ ./bench.py [SCALE..] > bench-$(git rev-parse --short HEAD).json
+def main():
+    scales = argv[1:] or list(C.SCALES)
+    if any(s not in C.SCALES for s in scales):
+        print(C.USAGE)
+        quit()
+
+    report = OrderedDict([
+        ('commit', get_commit()),
+        ('python', platform.python_version()),
+        ('results', [])])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in scales:
+            log('GENERATING {} FIXTURES...'.format(scale))
+            layers = {n: load(generate(n, *C.SCALES[scale]), tmp)
+                      for n in C.LAYERS}
+
+            for name, func in get_cases(layers):
+                log('{} {}'.format(scale, name))
+                result = OrderedDict([('scale', scale), ('function', name)])
+                result.update(measure(func))
+                report['results'].append(result)
+
+    fhm.print_json(report)
+
+
+def get_cases(layers):
+    data = fhm.parse_regions(layers[1])
+    totals = fhm.parse_cases_per_region(layers[0])
+    xarr, yarr = forecast.build_func_data(data)
+
+    return [
+        ('parse_regions', lambda: fhm.parse_regions(layers[1])),
+        ('parse_age_groups', lambda: fhm.parse_age_groups(layers[4])),
+        ('sum_data', lambda: fhm.sum_data(totals)),
+        ('build_progress', lambda: fhm.build_progress(data)),
+        ('print_regions', lambda: print_quiet(fhm.print_regions, data, True)),
+        ('forecast.get_functions', lambda: forecast.get_functions(xarr, yarr))
+    ]
+
+
+def measure(func):
+    # best and median of the timed runs, then one run under tracemalloc
+    times = []
+
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')  # overflows of the exp fit
+
+            while not times or (len(times) < C.RUNS and sum(times) < C.BUDGET):
+                t = time.perf_counter()
+                func()
+                times.append(time.perf_counter() - t)
+
+            tracemalloc.start()
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+
+    except Exception as e:
+        return OrderedDict([('error', '{}: {}'.format(type(e).__name__, e))])
+
+    finally:
+        tracemalloc.stop()
+
+    return OrderedDict([
+        ('runs', len(times)),
+        ('best_s', round(min(times), 6)),
+        ('median_s', round(median(times), 6)),
+        ('peak_kb', round(peak / 1024, 1))])
+
+
+def print_quiet(func, *args):
+    with open(os.devnull, 'w') as f, redirect_stdout(f):
+        func(*args)
+
+
+def generate(n, ndays, ncolumns):
+    # FeatureServer-shaped layer, the regions followed by municipality columns
+    rnd = random.Random(n)
+    columns = [C.REGIONS[i % len(C.REGIONS)] if i < len(C.REGIONS)
+               else '{}_kommun_{}'.format(C.REGIONS[i % len(C.REGIONS)], i)
+               for i in range(ncolumns)]
+
+    if n == 1:
+        return generate_days(rnd, columns, ndays)
+
+    key = 'Region' if n == 0 else 'Åldersgrupp'
+    names = columns if n == 0 else \
+        ['Ålder_{}_{}'.format(i * 10, i * 10 + 9) for i in range(ncolumns)]
+    fields = [field(C.OID, 'OID'), field(key, 'String')] + \
+        [field(C.TOTAL + k, 'Integer') for k in C.TOTALS]
+
+    features = []
+    for i, name in enumerate(names):
+        attributes = OrderedDict([(C.OID, i + 1), (key, name)])
+        attributes.update(
+            (C.TOTAL + k, rnd.randint(0, 10000)) for k in C.TOTALS)
+        features.append({'attributes': attributes})
+
+    return layer(fields, features)
+
+
+def generate_days(rnd, columns, ndays):
+    # new cases per day follow a logistic curve, split over the columns
+    weights = [rnd.random() for _ in columns]
+    weights = [w / sum(weights) for w in weights]
+    fields = [field(C.OID, 'OID'), field(fhm.C.DATE, 'Date')] + \
+        [field(k, 'Integer') for k in C.CASES] + \
+        [field(c, 'Integer') for c in columns] + \
+        [field(k, 'Integer') for k in C.DEATHS]
+
+    features, cases, deaths = [], 0, 0
+    for day in range(ndays):
+        x = 8 * (day / ndays - 0.5)
+        new = C.PEAK * len(columns) * 4 * math.exp(-x) / (1 + math.exp(-x)) ** 2
+        row = [int(new * w) + rnd.randint(0, 3) for w in weights]
+        dead = int(sum(row) * 0.02)
+        cases, deaths = cases + sum(row), deaths + dead
+
+        attributes = OrderedDict([
+            (C.OID, day + 1),
+            (fhm.C.DATE, C.START + day * C.DAY),
+            (C.CASES[0], sum(row)),
+            (C.CASES[1], cases)])
+        attributes.update(zip(columns, row))
+        attributes.update(zip(C.DEATHS, (dead, deaths)))
+        features.append({'attributes': attributes})
+
+    return layer(fields, features)
+
+
+def field(name, t):
+    return OrderedDict([
+        ('name', name), ('type', 'esriFieldType' + t), ('alias', name)])
+
+
+def layer(fields, features):
+    return OrderedDict([
+        ('objectIdFieldName', C.OID),
+        ('fields', fields),
+        ('features', features)])
+
+
+def load(jdata, tmp):
+    # written and read back, as the parsers see a decoded response
+    file = os.path.join(tmp, 'layer.json')
+    with open(file, 'w') as f:
+        json.dump(jdata, f, ensure_ascii=False)
+
+    with open(file, 'r') as f:
+        return json.load(f)
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode('utf-8').strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def log(text):
+    # progress on stderr, stdout is the report
+    print(u.debug(), text, file=sys.stderr)
+
+
+class C:
+    # scale: (days, columns), the real history is about 30 days x 21 regions
+    SCALES = OrderedDict([
+        ('1x', (30, 21)),
+        ('100x', (300, 210)),
+        ('10000x', (3000, 2100))
+    ])
+    LAYERS = [0, 1, 4]
+    RUNS = 10
+    BUDGET = 2  # seconds of timed runs per function, at least one run
+    OID = 'ObjectId'
+    TOTAL = 'Totalt_antal_'
+    TOTALS = ['fall', 'intensivvårdade', 'avlidna']
+    CASES = ['Totalt_antal_fall', 'Kumulativa_fall']
+    DEATHS = ['Antal_avlidna', 'Kumulativa_avlidna']
+    START = 1582502400000  # 20-02-24
+    DAY = 24 * 60 * 60 * 1000
+    PEAK = 50  # new cases per column on the peak day
+    REGIONS = [
+        'Blekinge', 'Dalarna', 'Gotland', 'Gävleborg', 'Halland',
+        'Jämtland_Härjedalen', 'Jönköping', 'Kalmar', 'Kronoberg',
+        'Norrbotten', 'Skåne', 'Stockholm', 'Sörmland', 'Uppsala', 'Värmland',
+        'Västerbotten', 'Västernorrland', 'Västmanland', 'Västra_Götaland',
+        'Örebro', 'Östergötland'
+    ]
+    USAGE = './bench.py [{}..]'.format('|'.join(SCALES))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from importlib.util import find_spec
+from http.server import ThreadingHTTPServer
+from statistics import median
+from threading import Thread
+from sys import argv
+import utils as u
+import subprocess
+import fhm_stub
+import fhm
+import tempfile
+import json
+import time
+import sys
+import os
+
+
+# Time to first output of the entry points on cached paths, i.e. answered from
+# data/mirror/ or today's data/data-YY-MM-DD.json (forecast.py from the local
+# stand-in for the API), against C.TARGET:
+#   $ ./bench_startup.py [RUNS]
+# Exits non-zero if a gated case takes longer than the target above the bare
+# interpreter start. Layer 1 and forecast.py are not gated, importing numpy
+# alone takes about as long as the target (and scipy several times that), so
+# they are reported only. Cases whose modules are not installed are skipped.
+def main():
+    runs = int(argv[1]) if len(argv) > 1 else C.RUNS
+    server = start_stub()
+    env = build_env(server.server_address[1])
+    failed = []
+
+    with tempfile.TemporaryDirectory() as cwd:
+        prepare(cwd, env)
+        bare = median(first_output(C.BARE, '', cwd, env) for _ in range(runs))
+        print(C.HEADER.format(
+            'CASE', 'FIRST OUTPUT', 'ABOVE BARE', 'IMPORTS', 'SLOWEST IMPORT'))
+        print(C.ROW.format('python (bare)', bare, 0, 0, '-'))
+
+        for name, args, stdin, GATED in C.CASES:
+            label = name if GATED else name + ' *'
+            missing = get_missing(name)
+            if missing:
+                print(C.SKIPPED.format(label, 'skipped, no ' + ', '.join(missing)))
+                continue
+
+            ms = median(first_output(args, stdin, cwd, env) for _ in range(runs))
+            imports = import_times(args, stdin, cwd, env)
+            slowest = max(imports, key=imports.get) if imports else '-'
+
+            print(C.ROW.format(
+                label, ms, ms - bare, sum(imports.values()),
+                '{} ({:.1f} ms)'.format(slowest, imports.get(slowest, 0))))
+
+            if GATED and ms - bare > C.TARGET:
+                failed.append(name)
+
+    server.shutdown()
+    print('* not gated')
+
+    if failed:
+        print(u.error(), 'OVER {} ms ABOVE BARE: {}'.format(
+            C.TARGET, ', '.join(failed)))
+        sys.exit(1)
+
+    print(u.info(), 'ALL GATED CASES UNDER {} ms ABOVE BARE'.format(C.TARGET))
+
+
+def get_missing(name):
+    return [m for m in C.REQUIRES.get(name, []) if find_spec(m) is None]
+
+
+def start_stub():
+    server = ThreadingHTTPServer((fhm_stub.C.HOST, 0), quiet)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+class quiet(fhm_stub.handler):
+    max_records = fhm_stub.C.MAX_RECORDS
+
+    def log_message(self, format, *args):
+        pass
+
+
+def build_env(port):
+    env = dict(os.environ)
+    env['FHM_URL'] = 'http://{}:{}/'.format(fhm_stub.C.HOST, port)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)  # measure with warm .pyc files
+    env['MPLBACKEND'] = 'Agg'  # forecast.py plots without opening a window
+
+    return env
+
+
+def prepare(cwd, env):
+    # fills the mirror and writes today's scraper data, then warms up
+    for n in fhm.api.LAYERS:
+        run([C.FHM, '-m', str(n)] + (['3'] if n == 1 else []), '', cwd, env)
+
+    data = {'TOTAL_CASES_PER_DAY': {datetime.today().strftime('%y-%m-%d'): 1}}
+    os.makedirs(os.path.join(cwd, 'data'), exist_ok=True)
+    with open(os.path.join(cwd, 'data', datetime.today().strftime(
+            'data-%y-%m-%d.json')), 'w') as f:
+        json.dump(data, f)
+
+    for name, args, stdin, _ in C.CASES:
+        if not get_missing(name):
+            run(args, stdin, cwd, env)
+
+
+def run(args, stdin, cwd, env, options=()):
+    return subprocess.run(
+        [sys.executable] + list(options) + args,
+        input=stdin.encode('utf-8'), cwd=cwd, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def first_output(args, stdin, cwd, env):
+    t = time.perf_counter()
+    p = subprocess.Popen(
+        [sys.executable] + args, cwd=cwd, env=env,
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    p.stdin.write(stdin.encode('utf-8'))
+    p.stdin.close()
+    os.read(p.stdout.fileno(), 1)
+    ms = (time.perf_counter() - t) * 1000
+
+    p.stdout.read()
+    p.wait()
+
+    return ms
+
+
+def import_times(args, stdin, cwd, env):
+    # cumulative ms of the top level imports, interpreter startup included
+    stderr = run(args, stdin, cwd, env, ['-X', 'importtime']).stderr
+    imports = {}
+
+    for line in stderr.decode('utf-8', 'replace').splitlines():
+        if not line.startswith('import time:') or '|' not in line[12:]:
+            continue
+
+        _, cumulative, name = line[12:].split('|')
+        if cumulative.strip().isdigit() and not name.startswith('  '):
+            imports[name.strip()] = int(cumulative) / 1000
+
+    return imports
+
+
+class C:
+    RUNS = 5
+    TARGET = 100  # ms to first output, above the bare interpreter start
+    DIR = os.path.dirname(os.path.abspath(__file__))
+    FHM = os.path.join(DIR, 'fhm.py')
+    SCRAPER = os.path.join(DIR, 'fhm_scraper.py')
+    FORECAST = os.path.join(DIR, 'forecast.py')
+    BARE = ['-c', 'print()']
+    CASES = [
+        ('fhm.py (usage)', [FHM], '', True),
+        ('fhm.py 0 --offline', [FHM, '0', '--offline'], '', True),
+        ('fhm.py 3 --offline', [FHM, '3', '--offline'], '', True),
+        ('fhm.py 4 --offline', [FHM, '4', '--offline'], '', True),
+        ('fhm.py 1 3 --offline', [FHM, '1', '3', '--offline'], '', False),
+        ('fhm_scraper.py (saved)', [SCRAPER], 'n\n', True),
+        ('forecast.py', [FORECAST], '', False)
+    ]
+    REQUIRES = {'forecast.py': ['numpy', 'scipy']}  # before its first output
+    HEADER = '{:26}{:>14}{:>12}{:>12}  {}'
+    ROW = '{:26}{:>11.1f} ms{:>9.1f} ms{:>9.1f} ms  {}'
+    SKIPPED = '{:26}{:>14}'
+
+
+if __name__ == "__main__":
+    main()
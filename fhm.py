@@ -1,12 +1,35 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-from collections import Counter, OrderedDict
-from datetime import datetime, date
-from modules import requests
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, date, timezone
+from functools import lru_cache
+from itertools import chain, repeat
+from operator import itemgetter
 from sys import argv
+from threading import Lock, Thread
+from urllib.parse import quote
 import utils as u
+import fhm_pbf
+import codecs
+import csv
+import hashlib
+import io
 import json
+import os
+import queue
+import random
+import re
+import sys
+import time
+import unicodedata
+
+fhm_archive = u.lazy('fhm_archive')
+fhm_store = u.lazy('fhm_store')
+futures = u.lazy('concurrent.futures')
+requests = u.lazy('modules.requests')
+socket = u.lazy('socket')
+numpy = u.lazy('numpy')
 
 
 def main():
@@ -15,118 +38,229 @@ def main():
     # p=2: Antal per dag ålder och kön  # NO DATA
     # p=3: Totalt antal per kön
     # p=4: Totalt antal per åldersgrupp
+    INCREMENTAL = get_flag(C.INCREMENTAL)
+    mirror.OFFLINE = get_flag(C.OFFLINE)
+    mirror.ENABLED = get_flag(C.MIRROR_FLAG) or mirror.OFFLINE
+    mirror.TTL = int(get_option(C.TTL, mirror.TTL))
+    if get_flag(C.PBF):
+        api.FORMAT = 'pbf'
+    hedge = get_option(C.HEDGE)
+    fetcher.HEDGE = None if hedge is None else float(hedge)
+    output.FORMAT = get_option(C.OUTPUT, output.FORMAT)
+    if output.FORMAT not in output.WRITERS:
+        print(C.USAGE)
+        quit()
+
+    if get_flag(C.WATCH):  # polls the layers, prints changed cells
+        interval = int(get_option(C.INTERVAL, C.WAIT))
+        port = get_option(C.SOCKET)
+        watch(get_layers(argv[1:]), interval, get_writer(port))
+        return
+
+    if argv[1:2] == [C.SNAPSHOT]:  # all layers in one run
+        print_json(get_snapshot(get_layers()))
+        return
+
+    if argv[1:2] == [C.BATCH]:  # many queries, each layer fetched once
+        print_batch(run_batch(argv[2:] or read_specs(), INCREMENTAL))
+        return
+
     p0, p1, p2 = get_params()
 
-    url = api.url(p0)
-    jdata = get_data(url)
-
-    if p0 == 0:
-        data = parse_cases_per_region(jdata)
-
-        print_cases_per_region(data, p1)
-        print_cases_per_region_sum(data)
-
-    elif p0 == 1:
-        data = parse_regions(jdata, True) \
-            if p1 == 2 or p1 == 6 \
-            else parse_regions(jdata)
-
-        if p1 == 0:  # (date: new-cases)
-            print_regions(data, False),
-        elif p1 == 1:  # (date: new-cases per region)
-            print_regions(data, True, False, p2),
-        elif p1 == 2:  # (date: deaths)
-            print_regions(data, True, False, C.DEATHS),
-        elif p1 == 3:  # (date: total)
-            print_regions(data, False, True),
-        elif p1 == 4:  # (date: total per region)
-            print_regions(data, True, True, p2),
-        elif p1 == 5:  # (region: total-cases)
-            print_regions_sum(data)
-        elif p1 == 6:  # (date: deaths)
-            print_regions(data, True, True, C.DEATHS),
-
-    elif p0 == 2:
+    if p0 == 2:
         print('NO DATA')
+        return
 
-    elif p0 == 3:
-        data = parse_gender(jdata)
+    if p0 == 1 and p1 == 5 and not INCREMENTAL:  # summed by the server
+        data = get_regions_sum(p0)
+    elif p0 == 1 and INCREMENTAL:
+        data = parse_seen(get_data_incremental(p0), p1 in C.DEATHS_MODES)
+    else:
+        url = api.url(p0)
+        data = parse_layer(p0, record(get_data(url), p0), p1 in C.DEATHS_MODES)
 
-        print_gender(data)
-        print_gender_sum(data)
+    if p0 == 1 and p1 in C.REGION_MODES and not has_region(data, p2):
+        print('NO SUCH REGION')
+        quit()
 
-    elif p0 == 4:
-        data = parse_age_groups(jdata)
+    print_sections(build(data, p0, p1, p2))
 
-        print_age_groups(data, p1)
-        print_age_groups_sum(data)
 
+def run_batch(specs, INCREMENTAL=False):
+    queries = [(spec, get_params(spec.split())) for spec in specs]
+    layers = sorted(set(p0 for _, (p0, _, _) in queries if p0 != 2))
+    session = get_session(max(len(layers), 1))
 
-def parse_cases_per_region(jdata):
-    data = OrderedDict()
-    region = None
+    def fetch(n):
+        deaths = set(p1 in C.DEATHS_MODES for _, (p0, p1, _) in queries if p0 == 1)
 
-    for r in jdata['features']:
-        for i, (k, v) in enumerate(r['attributes'].items()):
+        if n == 1 and INCREMENTAL:
+            seen = get_data_incremental(n)
+            return {DEATHS: parse_seen(seen, DEATHS) for DEATHS in deaths}
 
-            if i > 0 and i != 3 and i < 6:
+        jdata = record(get_data(api.url(n), session), n)
 
-                if i == 1:
-                    region = v.upper()
-                    data[region] = OrderedDict()
+        if n != 1:
+            return {False: parse_layer(n, jdata)}
 
-                else:
-                    n = 0 if v is None else v
-                    text = k.replace('Totalt_antal_', '').capitalize()
+        jdata['features'] = list(jdata['features'])  # parsed once per variant
 
-                    data[region][text] = int(n)
+        return {DEATHS: parse_layer(n, jdata, DEATHS) for DEATHS in deaths}
 
-    return data
+    with futures.ThreadPoolExecutor(max_workers=max(len(layers), 1)) as executor:
+        data = dict(zip(layers, executor.map(fetch, layers)))
+
+    results = OrderedDict()
+    for spec, (p0, p1, p2) in queries:
+        if p0 == 2:
+            results[spec] = OrderedDict([('NO DATA', OrderedDict())])
+            continue
+
+        d = data[p0][p0 == 1 and p1 in C.DEATHS_MODES]
+        if p0 == 1 and p1 in C.REGION_MODES and not has_region(d, p2):
+            results[spec] = OrderedDict([('NO SUCH REGION', OrderedDict())])
+        else:
+            results[spec] = build(d, p0, p1, p2)
+
+    return results
+
+
+def read_specs():
+    # one query per line, e.g. '1 1 Stockholm'
+    return [l.strip() for l in sys.stdin if l.strip() and not l.startswith('#')]
+
+
+def print_batch(results):
+    if output.FORMAT == 'json':
+        sys.stdout.write(output.json(results))
+    else:
+        print_sections(OrderedDict(
+            ('{}: {}'.format(spec, title), rows)
+            for spec, sections in results.items()
+            for title, rows in sections.items()))
+
+
+def get_snapshot(layers=None):
+    layers = api.LAYERS if layers is None else layers
+    session = get_session(len(layers))
+
+    def fetch(n):
+        return parse_layer(n, record(get_data(api.url(n), session), n))
+
+    with futures.ThreadPoolExecutor(max_workers=len(layers)) as executor:
+        return OrderedDict(zip(layers, executor.map(fetch, layers)))
+
+
+def parse_layer(n, jdata, DEATHS=False):
+    if n == 1:
+        return parse_regions(jdata, DEATHS)
+
+    return {
+        0: parse_cases_per_region,
+        3: parse_gender,
+        4: parse_age_groups
+    }[n](jdata)
+
+
+def parse_cases_per_region(jdata):
+    return parse_totals(jdata)
 
 
 def parse_regions(jdata, DEATHS=False):
-    data = OrderedDict()
+    # dates x regions matrix, one row per feature and no per-cell dicts
+    require_numpy()
+    dates, rows, keys, regions = [], [], None, []
 
-    for i in jdata['features']:
-        date = format_date(i['attributes']['Statistikdatum'])
-        data[date] = OrderedDict()
+    for f in jdata['features']:
+        attributes = f['attributes']
 
-        for i, (region, v) in enumerate(i['attributes'].items()):
-            n = 0 if v is None else v
-            text = region.replace('_', ' ')
+        if keys is None:
+            keys, regions = plan_regions(get_fields(jdata, attributes), DEATHS)
+            get = itemgetter(*keys)
 
-            if not DEATHS:
-                if i > 3 and i < 25:  # only regions
-                    data[date][text] = int(n)
+        dates.append(format_date(attributes[C.DATE]))
+        rows.append(get(attributes))
 
-            elif i == 25:  # antal avlidna
-                data[date][text] = int(n)
+    matrix = numpy.array(rows, dtype=float).reshape(len(rows), len(regions))
 
-    return data
+    return series(dates, regions, numpy.nan_to_num(matrix).astype(numpy.int64))
+
+
+def parse_seen(seen, DEATHS=False):
+    # the region columns, or the last one, antal avlidna
+    columns, times, matrix = seen
+    dates = [format_date(t) for t in times.tolist()]
+
+    if DEATHS:
+        return series(dates, [C.DEATHS], matrix[:, -1:])
+
+    return series(dates, [k.replace('_', ' ') for k in columns[:-1]], matrix[:, :-1])
+
+
+def require_numpy():
+    try:
+        numpy.ndarray
+    except ImportError:
+        print(u.error(), 'REQUIRES numpy')
+        quit()
 
 
 def parse_age_groups(jdata):
-    data = OrderedDict()
-    age_group = None
+    return parse_totals(jdata)
 
-    for i in jdata['features']:
-        for i, (k, v) in enumerate(i['attributes'].items()):
 
-            if i > 0 and i != 2:
+def parse_totals(jdata):
+    data = OrderedDict()
+    get = None
 
-                if i == 1:
-                    age_group = v.upper()
-                    data[age_group] = OrderedDict()
+    for f in jdata['features']:
+        attributes = f['attributes']
 
-                else:
-                    n = 0 if v is None else v
-                    text = k.replace('Totalt_antal_', '').capitalize()
+        if get is None:
+            key, keys, names = plan_totals(get_fields(jdata, attributes))
+            get = itemgetter(*keys)
 
-                    data[age_group][text] = int(n)
+        values = get(attributes)
+        values = values if len(keys) != 1 else (values,)
+        data[attributes[key].upper()] = OrderedDict(
+            zip(names, [0 if v is None else int(v) for v in values]))
 
     return data
 
 
+def get_fields(jdata, attributes):
+    # layer metadata, or the attributes of the first feature
+    if jdata.get('fields'):
+        return tuple((f['name'], f['type']) for f in jdata['fields'])
+
+    return tuple(
+        (k, C.STRING if isinstance(v, str) else C.INTEGER)
+        for k, v in attributes.items())
+
+
+@lru_cache(maxsize=None)
+def plan_totals(fields):
+    # (key column, value columns, output names), e.g. Totalt_antal_fall -> Fall
+    key = next(name for name, t in fields if t == C.STRING)
+    keys = tuple(name for name, t in fields if name.startswith(C.TOTAL))
+    names = tuple(k[len(C.TOTAL):].capitalize() for k in keys)
+
+    return key, keys, names
+
+
+@lru_cache(maxsize=None)
+def plan_regions(fields, DEATHS=False):
+    # (value columns, output names), either the regions or antal avlidna
+    if DEATHS:
+        keys = tuple(name for name, t in fields if name == C.DEATHS_FIELD)
+    else:
+        keys = tuple(
+            name for name, t in fields
+            if t in C.INTEGERS and not name.startswith(C.NOT_REGIONS))
+
+    return keys, [k.replace('_', ' ') for k in keys]
+
+
 def parse_gender(jdata):
     return parse_age_groups(jdata)
 
@@ -143,77 +277,107 @@ def sum_data(data):
 
 
 def build_progress(data):
-    progress = OrderedDict()
-    prev = 0
+    return OrderedDict(zip(data.dates, data.totals().cumsum().tolist()))
 
-    for k, v in data.items():
-        prev += sum(v.values())
-        progress[k] = prev
 
-    return progress
+def build(data, p0, p1=None, p2=None):
+    # sections of (title: rows) for a query, as printed by main
+    if p0 == 1:
+        return {
+            0: lambda: build_regions(data, False),  # (date: new-cases)
+            1: lambda: build_regions(data, True, False, p2),  # (date: new-cases per region)
+            2: lambda: build_regions(data, True, False, C.DEATHS),  # (date: deaths)
+            3: lambda: build_regions(data, False, True),  # (date: total)
+            4: lambda: build_regions(data, True, True, p2),  # (date: total per region)
+            5: lambda: build_regions_sum(data),  # (region: total-cases)
+            6: lambda: build_regions(data, True, True, C.DEATHS),  # (date: deaths)
+            7: lambda: build_metrics(data, 'average', p2),  # (date: 7-day average)
+            8: lambda: build_metrics(data, 'incidence', p2),  # (date: 7-day per 100 000)
+            9: lambda: build_metrics(data, 'growth', p2)  # (date: week-over-week %)
+        }.get(p1, OrderedDict)()
 
+    return build_totals(data, p1 if p0 != 3 else None)
 
-def print_regions(data, ALL=False, TOTAL=False, REGION=None):
-    if REGION is not None:
-        if list(data.values())[-1].get(REGION) is None:
-            print('NO SUCH REGION')
-            quit()
-        elif TOTAL:
-            print(u.color.blue(REGION.upper() + ' TOTALT'))
-        else:
-            print(u.color.blue(REGION.upper() + ' NYA FALL'))
 
-    if ALL:
-        l = len(data) - 1
-        prev = [0] * 21  # regions
-        for i, (date, v) in enumerate(data.items()):
-            if REGION is None:
-                print(u.color.blue(date))
+def build_regions(data, ALL=False, TOTAL=False, REGION=None):
+    sections = OrderedDict()
 
-            for idx, (region, n) in enumerate(v.items()):
-                if REGION is None:
-                    prev[idx] = prev[idx] + n if TOTAL else n
-                    print(C.FORMAT.format(region, prev[idx]))
+    if ALL:
+        matrix = data.cumsum() if TOTAL else data.matrix
 
-                elif REGION == region:
-                    prev[idx] = prev[idx] + n if TOTAL else n
-                    print(C.FORMAT.format(date, prev[idx]))
+        if REGION is None:
+            for date, row in zip(data.dates, matrix.tolist()):
+                sections[date] = OrderedDict(zip(data.regions, row))
 
-            if REGION is None and i != l:
-                print()
+        else:
+            for region in data.resolve(REGION):
+                title = region.upper() + (' TOTALT' if TOTAL else ' NYA FALL')
+                column = matrix[:, data.index[region]]
+                sections[title] = OrderedDict(zip(data.dates, column.tolist()))
 
     else:
-        if TOTAL:
-            print(u.color.blue('SVERIGE TOTALT'))
-        else:
-            print(u.color.blue('SVERIGE NYA FALL'))
+        title = 'SVERIGE TOTALT' if TOTAL else 'SVERIGE NYA FALL'
+        totals = data.totals()
+        totals = totals.cumsum() if TOTAL else totals
+        sections[title] = OrderedDict(zip(data.dates, totals.tolist()))
 
-        prev = 0
-        for date, v in data.items():
-            n = sum(v.values())
-            prev = prev + n if TOTAL else n
+    return sections
 
-            print(C.FORMAT.format(date, prev))
 
+def build_metrics(data, name, REGION=None):
+    sections = OrderedDict()
+    m = metrics(data)
 
-def print_regions_sum(data):
-    tot = sum_data(data)
-    print(u.color.blue('TOTALT'))
+    for region in [C.SWEDEN] if REGION is None else data.resolve(REGION):
+        title = region.upper() + C.METRICS[name]
+        sections[title] = OrderedDict(zip(data.dates, m.column(name, region)))
 
-    for k, v in sorted(tot.items(), key=lambda k: k[1]):
-        print(C.FORMAT.format(k, v))
+    return sections
 
 
-def print_age_groups(data, SORT=None):
-    l = len(data)
-    for i, (k, v) in enumerate(sort(data, SORT)):
-        print(u.color.blue(k))
+def build_regions_sum(data):
+    tot = zip(data.regions, data.region_totals().tolist())
+
+    return OrderedDict([('TOTALT', OrderedDict(sorted(tot, key=lambda k: k[1])))])
+
+
+def build_totals(data, SORT=None):
+    sections = OrderedDict(sort(data, SORT))
+    sections['TOTALT'] = OrderedDict(sum_data(data))
+
+    return sections
+
+
+def has_region(data, REGION):
+    return REGION is None or data.resolve(REGION) is not None
 
-        for case, n in v.items():
-            print(C.FORMAT.format(case, n))
 
-        if i != l:
-            print()
+def fold(text):
+    # 'Västra Götaland', 'vastra_gotaland' -> 'vastragotaland'
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if c.isalnum()).lower()
+
+
+def print_sections(sections):
+    # rendered in bulk, one write for the whole output
+    sys.stdout.write(output.render(sections))
+    sys.stdout.flush()
+
+
+def print_regions(data, ALL=False, TOTAL=False, REGION=None):
+    if not has_region(data, REGION):
+        print('NO SUCH REGION')
+        quit()
+
+    print_sections(build_regions(data, ALL, TOTAL, REGION))
+
+
+def print_regions_sum(data):
+    print_sections(build_regions_sum(data))
+
+
+def print_age_groups(data, SORT=None):
+    print_sections(build_totals(data, SORT))
 
 
 def sort(data, SORT):
@@ -223,45 +387,30 @@ def sort(data, SORT):
     return data.items() if SORT is None else sorted(data.items(), key=lambda x: x[1][s])
 
 
-def print_age_groups_sum(data):
-    tot = sum_data(data)
-    print(u.color.blue('TOTALT'))
-
-    for k, v in tot.items():
-        print(C.FORMAT.format(k, v))
-
-
 def print_gender(data):
     print_age_groups(data)
 
 
-def print_gender_sum(data):
-    print_age_groups_sum(data)
-
-
 def print_cases_per_region(data, SORT):
     print_age_groups(data, SORT)
 
 
-def print_cases_per_region_sum(data):
-    print_age_groups_sum(data)
-
-
-def get_params():
+def get_params(args=None):
+    args = argv[1:] if args is None else args
     try:
-        p0 = int(argv[1:][0])
+        p0 = int(args[0])
         p1 = None
         p2 = None
 
         try:
-            p1 = int(argv[1:][1])
+            p1 = int(args[1])
         except Exception:
             if p0 == 1:
                 print(C.USAGE)
                 quit()
 
         try:
-            tmp = ' '.join(argv[1:][2:]).title()
+            tmp = ' '.join(args[2:]).title()
             p2 = tmp if bool(tmp) else None  # no empty string
         except Exception:
             pass
@@ -277,42 +426,1098 @@ def get_params():
         quit()
 
 
-def get_data(url):
+def get_layers(args=None):
+    args = argv[2:] if args is None else args
+    try:
+        layers = [int(n) for n in args] or api.LAYERS
+        if any(n not in api.LAYERS for n in layers):
+            raise ValueError
+
+        return layers
+
+    except ValueError:
+        print(C.USAGE)
+        quit()
+
+
+def get_flag(flag):
+    if flag in argv:
+        argv.remove(flag)
+        return True
+
+    return False
+
+
+def get_option(flag, default=None):
+    if flag in argv[:-1]:
+        i = argv.index(flag)
+        value = argv[i + 1]
+        del argv[i:i + 2]
+        return value
+
+    return default
+
+
+def get_session(nconn=10):
+    # one pooled keep-alive session, so concurrent requests share connections
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=nconn, pool_maxsize=nconn)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+
+def get_data(url, session=None):
+    if mirror.ENABLED:
+        return mirror.get(url, session)
+
+    return fetch_data(url, session)
+
+
+def fetch_data(url, session=None):
+    jdata = get_stream(url, session)
+    jdata['features'] = get_features(url, session, jdata, jdata['features'])
+
+    return jdata
+
+
+def get_json(url, session=None):
+    return fetcher.get(url, session, lambda res: decode(url, res))
+
+
+def decode(url, res):
+    if api.PBF in url and res.content.lstrip()[:1] != b'{':
+        return fhm_pbf.decode(res.content)
+
+    return check(url, json.loads(res.text))  # errors are json even for f=pbf
+
+
+def check(url, jdata):
+    # the API answers errors with 200 and an error body
+    error = jdata.get('error') if isinstance(jdata, dict) else None
+    if error is not None:
+        raise FetchError(url, error.get('message', 'Error response'), error.get('code'))
+
+    return jdata
+
+
+def get_status(e):
+    res = getattr(e, 'response', None)
+    return None if res is None else res.status_code
+
+
+def get_stream(url, session=None):
+    if api.PBF in url:  # decoded from the whole (smaller) body
+        jdata = get_json(url, session)
+        jdata['features'] = iter(jdata.get('features', []))
+        return jdata
+
+    return fetcher.get(
+        url, session, lambda res: check(url, stream(res).decode()), STREAM=True)
+
+
+def get_features(url, session, jdata, features):
+    # A response is capped at the server's record limit, so its length is the
+    # page size once it has been read. A body cut off while streaming is
+    # requested again from the first feature not yet yielded.
+    n, size, retry = 0, 0, 0
+
+    while True:
+        try:
+            for f in features:
+                n, size = n + 1, size + 1
+                yield f
+
+            break
+
+        except (requests.exceptions.RequestException, ValueError) as e:
+            if retry == fetcher.RETRIES or not fetcher.retryable(e):
+                raise FetchError(url, '{}: {}'.format(type(e).__name__, e), get_status(e))
+
+            fetcher.backoff(retry)
+            retry += 1
+            jdata = get_stream(api.offset(url, n), session)
+            features, size = jdata['features'], 0
+
+    if jdata.get('exceededTransferLimit'):
+        yield from get_pages(
+            url, session, n, size, jdata.get('objectIdFieldName', C.OID))
+
+
+def get_pages(url, session, start, size, oid):
+    # the remaining pages are requested at once and yielded in order
+    count = get_json(url + api.COUNT, session)['count']
+    offsets = range(start, count, size)
+
+    if session is None:
+        session = get_session(C.NPAGES)
+
+    def fetch(offset):
+        return get_json(api.page(url, offset, size, oid), session)['features']
+
+    executor = futures.ThreadPoolExecutor(max_workers=C.NPAGES)
+    pages = executor.map(fetch, offsets)
+    executor.shutdown(wait=False)
+
+    return chain.from_iterable(pages)
+
+
+def get_regions_sum(n=1):
+    # One pre-aggregated row with the sum of every region column. Offline, or
+    # when the server can not sum, the (mirrored) layer is summed here.
+    if not mirror.OFFLINE:
+        try:
+            keys, regions = plan_regions(get_fields(get_data(api.layer(n)), {}))
+            jdata = get_data(api.stats(n, keys))
+
+            row = [0] * len(keys)
+            for f in jdata['features']:
+                row = [f['attributes'].get(k) or 0 for k in keys]
+
+            return series(
+                [C.TOTAL_DATE], regions, numpy.array([row], dtype=numpy.int64))
+
+        except FetchError as e:
+            print(u.error(), e, '- SUMMING THE LAYER')
+
+    return parse_layer(n, record(get_data(api.url(n)), n))
+
+
+def get_data_incremental(n=1):
+    # Only the newest Statistikdatum changes from day to day. Seen days are
+    # kept on disk as parsed rows, only rows from the last seen day onwards
+    # are fetched, recorded, parsed and appended: (columns, times, matrix).
+    require_numpy()
+    seen = read_seen(n)
+
+    if seen is None:
+        delta = record(get_data(api.url(n)), n)
+    else:
+        try:
+            last = int(seen[1][-1])
+            delta = record(get_data(api.url(n, api.since(last))), n, True)
+
+        except FetchError as e:
+            print(u.error(), e, '- SEEN DAYS ONLY')
+            return seen
+
+    columns, rows = None, []
+    for f in delta['features']:
+        attributes = f['attributes']
+        if columns is None:
+            keys, _ = plan_regions(get_fields(delta, attributes))
+            columns = list(keys) + [C.DEATHS_FIELD]
+
+        rows.append([attributes[C.DATE]] + [attributes.get(k) or 0 for k in columns])
+
+    if not rows:
+        return seen or ([C.DEATHS_FIELD], numpy.zeros(0, C.ROW), numpy.zeros((0, 1), C.ROW))
+
+    if seen is not None and columns != seen[0]:  # new fields, all days again
+        print(u.debug(), 'LAYER {} CHANGED, FETCHING ALL DAYS'.format(n))
+        remove_data(C.file(n))
+        return get_data_incremental(n)
+
+    rows = numpy.array(rows, dtype=C.ROW)
+    write_seen(n, columns, rows, seen is not None)
+    if seen is None:
+        return columns, rows[:, 0], rows[:, 1:]
+
+    keep = seen[1] < rows[0, 0]  # the last seen day may be revised
+    return columns, numpy.concatenate([seen[1][keep], rows[:, 0]]), \
+        numpy.vstack([seen[2][keep], rows[:, 1:]])
+
+
+def read_seen(n):
+    # (columns, times, matrix) of the seen days, None without any
+    header = read_data(C.file(n))
+    if not isinstance(header, dict) or 'columns' not in header or \
+            not os.path.isfile(C.rows(n)):
+        return None
+
+    columns = header['columns']
+    rows = numpy.fromfile(C.rows(n), dtype=C.ROW)
+    rows = rows[:len(rows) - len(rows) % (len(columns) + 1)].reshape(-1, len(columns) + 1)
+
+    return None if not len(rows) else (columns, rows[:, 0], rows[:, 1:])
+
+
+def write_seen(n, columns, rows, APPEND=True):
+    # rows of [time, columns..], replacing the seen rows from their first
+    # day on, found from the end of the file
+    file, size = C.rows(n), rows.shape[1] * rows.itemsize
+
+    try:
+        if not APPEND:
+            save_data({'columns': columns}, C.file(n))
+
+        with open(file, 'r+b' if APPEND and os.path.isfile(file) else 'wb') as f:
+            keep = f.seek(0, os.SEEK_END)
+            keep -= keep % size
+            while keep >= size:
+                f.seek(keep - size)
+                if numpy.frombuffer(f.read(rows.itemsize), dtype=C.ROW)[0] < rows[0, 0]:
+                    break
+
+                keep -= size
+
+            f.seek(keep)
+            f.truncate()
+            f.write(rows.tobytes())
+
+    except (OSError, IOError) as e:
+        print("IOError:", e)
+
+
+def remove_data(file):
+    try:
+        os.remove(file)
+
+    except FileNotFoundError:
+        pass
+
+
+def record(jdata, n=1, DELTA=False):
+    # fetched layers are kept in the query store, and layer 1 is archived by
+    # date and column, on a copy, jdata may be the mirror's own. A DELTA of
+    # layer 1 only holds the days from the last seen one on.
+    if mirror.OFFLINE or n not in C.STORED:
+        return jdata
+
+    if n != 1:
+        jdata = dict(jdata, features=list(jdata['features']))
+        fhm_store.add_totals(C.STORED[n], parse_totals(jdata))
+        return jdata
+
+    return dict(jdata, features=archive(jdata, jdata['features'], DELTA))
+
+
+def archive(jdata, features, DELTA=False):
+    # The features are passed on as they stream in and only their cells are
+    # kept, archived and stored once the layer has been read.
+    history, fields = OrderedDict(), None
+
+    for f in features:
+        attributes = f['attributes']
+        if fields is None:
+            fields = get_fields(jdata, attributes)
+
+        history[format_date(attributes[C.DATE])] = get_cells(attributes)
+        yield f
+
+    fhm_archive.add(history, 'fhm', DELTA)
+    if fields is not None:
+        fhm_store.add_days(get_days(history, fields), 'fhm')
+
+
+def get_history(jdata):
+    # {date: {column: value}} of every numeric column
+    return OrderedDict(
+        (format_date(f['attributes'][C.DATE]), get_cells(f['attributes']))
+        for f in jdata['features'])
+
+
+def get_cells(attributes):
+    return OrderedDict(
+        (k.replace('_', ' '), v) for k, v in attributes.items()
+        if k not in (C.OID, 'FID', C.DATE) and not isinstance(v, str))
+
+
+def get_days(history, fields):
+    # (date, region, cases, deaths), Sverige from the totals of the day
+    _, regions = plan_regions(fields)
+
+    for date, cells in history.items():
+        for region in regions:
+            yield date, region, cells.get(region), None
+
+        yield date, C.SWEDEN, cells.get(C.TOTAL_CASES), cells.get(C.DEATHS)
+
+
+def watch(layers, interval, write):
+    # Every interval, each layer is probed (count and last edit date) and only
+    # fetched when the probe changed. The changed cells are written as one
+    # NDJSON line per layer, [row, column, old, new] with null when missing.
+    session = get_session(len(layers))
+    probes, cells = {}, {}
+
     try:
-        res = requests.get(url)
+        while True:
+            for n in layers:
+                try:
+                    url = api.url(n)
+                    probe = mirror.probe(url, session)
+                    if probe is not None and probe == probes.get(n):
+                        continue
+
+                    jdata = record(fetch_data(url, session), n)
+                    new = get_history(jdata) if n == 1 else parse_totals(jdata)
+                    if n in cells:
+                        changes = diff_cells(cells[n], new)
+                        if changes:
+                            write(json.dumps(OrderedDict([
+                                ('time', time.strftime('%y-%m-%d %H:%M:%S')),
+                                ('layer', n),
+                                ('changes', changes)]), ensure_ascii=False) + '\n')
+
+                    probes[n], cells[n] = probe, new
+
+                except FetchError as e:
+                    print(u.error(), e, file=sys.stderr)
+
+            time.sleep(interval)
+
+    except KeyboardInterrupt:
+        pass
+
+
+def diff_cells(old, new):
+    changes = []
+
+    for row in list(old) + [r for r in new if r not in old]:
+        a, b = old.get(row, {}), new.get(row, {})
+        for column in list(a) + [c for c in b if c not in a]:
+            if a.get(column) != b.get(column):
+                changes.append([row, column, a.get(column), b.get(column)])
+
+    return changes
+
+
+def get_writer(port=None):
+    # lines to stdout, or to every client connected to a local socket
+    if port is None:
+        def write(line):
+            sys.stdout.write(line)
+            sys.stdout.flush()
+
+        return write
+
+    server = socket.create_server((C.HOST, int(port)))
+    clients, lock = [], Lock()
+
+    def accept():
+        while True:
+            conn, _ = server.accept()
+            with lock:
+                clients.append(conn)
+
+    Thread(target=accept, daemon=True).start()
+
+    def write(line):
+        with lock:
+            for conn in list(clients):
+                try:
+                    conn.sendall(line.encode('utf-8'))
+
+                except OSError:
+                    clients.remove(conn)
+                    conn.close()
+
+    return write
+
+
+def read_data(file):
+    if os.path.isfile(file):
+        try:
+            with open(file, 'r') as f:
+                return json.load(f)
+
+        except (IOError, ValueError) as e:
+            print("IOError:", e)
+
+
+def save_data(jdata, file):
+    try:
+        os.makedirs(C.DIR, exist_ok=True)
+        with open(file, 'w') as f:
+            json.dump(jdata, f, ensure_ascii=False)
+
+    except (OSError, IOError) as e:
+        print("IOError:", e)
+
+
+def print_json(json_data):
+    print(json.dumps(
+        json_data, indent=4, ensure_ascii=False, default=lambda o: o.to_dict()))
+
+
+class FetchError(Exception):
+    # a request that failed for good, or an error response of the API
+    def __init__(self, url, reason, code=None):
+        super().__init__('{} ({})'.format(reason, url))
+        self.url = url
+        self.reason = reason
+        self.code = code
+
+
+class fetcher:
+    # Every request goes through get. An attempt times out, and failures that
+    # may pass (connection errors, timeouts, 429 and 5xx, also as an error
+    # body) are retried with jittered exponential backoff. With HEDGE set, a
+    # duplicate attempt is sent when the first is slower than that percentile
+    # of the latencies seen so far, and the first answer wins.
+    TIMEOUT = (3.05, 30)  # connect, read seconds
+    RETRIES = 3
+    BACKOFF = 0.5  # seconds, doubled for every retry
+    MAX_BACKOFF = 8
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+    HEDGE = None  # percentile, e.g. 95
+    HEDGE_DELAY = 1  # seconds, until MIN_SAMPLES latencies are seen
+    MIN_SAMPLES = 5
+    LATENCIES = deque(maxlen=100)
+
+    @staticmethod
+    def get(url, session=None, read=None, headers=None, STREAM=False):
+        # read turns the response into data within the attempt, so errors
+        # in the body are retried as well. A streamed body is only read up
+        # to its features here, get_features resumes it when cut off.
+        for retry in range(fetcher.RETRIES + 1):
+            try:
+                return fetcher.hedged(url, session, read, headers, STREAM)
+
+            except FetchError as e:
+                if retry == fetcher.RETRIES or not fetcher.retryable(e):
+                    raise
+
+            except (requests.exceptions.RequestException, ValueError) as e:
+                if retry == fetcher.RETRIES or not fetcher.retryable(e):
+                    raise FetchError(
+                        url, '{}: {}'.format(type(e).__name__, e), get_status(e)) from e
+
+            fetcher.backoff(retry)
+
+    @staticmethod
+    def backoff(retry):
+        delay = min(fetcher.MAX_BACKOFF, fetcher.BACKOFF * 2 ** retry)
+        time.sleep(random.uniform(0, delay))  # full jitter
+
+    @staticmethod
+    def retryable(e):
+        if isinstance(e, (FetchError, requests.exceptions.HTTPError)):
+            return (e.code if isinstance(e, FetchError) else get_status(e)) \
+                in fetcher.RETRY_STATUS
+
+        return isinstance(e, (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+            ValueError))
+
+    @staticmethod
+    def hedged(url, session, read, headers, STREAM):
+        delay = fetcher.delay()
+        if delay is None:
+            return fetcher.attempt(url, session, read, headers, STREAM)
+
+        results, lock, done = queue.Queue(), Lock(), []
+
+        def attempt():
+            opened = []
+            try:
+                ok, value = True, fetcher.attempt(url, session, read, headers, STREAM, opened)
+
+            except Exception as e:
+                ok, value = False, e
+
+            with lock:
+                if done:  # the other attempt won
+                    return close(opened)
+
+                results.put((ok, value, opened))
+
+        def close(opened):
+            for res in opened:
+                res.close()
+
+        # daemon threads, a slow loser does not hold up the exit
+        Thread(target=attempt, daemon=True).start()
+        pending, hedged, error = 1, False, None
+
+        while pending:
+            try:
+                ok, value, _ = results.get(timeout=None if hedged else delay)
+
+            except queue.Empty:
+                Thread(target=attempt, daemon=True).start()
+                pending, hedged = pending + 1, True
+                continue
+
+            pending -= 1
+            if ok:
+                with lock:  # a loser that already answered is closed here
+                    done.append(True)
+                    while not results.empty():
+                        close(results.get()[2])
+
+                return value
+
+            error, hedged = value, True  # the other attempt still counts
+
+        raise error
+
+    @staticmethod
+    def attempt(url, session, read, headers, STREAM, opened=None):
+        t = time.time()
+        res = (requests if session is None else session).get(
+            url, headers=headers, stream=STREAM, timeout=fetcher.TIMEOUT)
+        if opened is not None:
+            opened.append(res)
         res.raise_for_status()
 
-        return json.loads(res.text)
+        data = res if read is None else read(res)
+        fetcher.LATENCIES.append(time.time() - t)
+
+        return data
+
+    @staticmethod
+    def delay():
+        if fetcher.HEDGE is None:
+            return None
+
+        latencies = sorted(fetcher.LATENCIES)
+        if len(latencies) < fetcher.MIN_SAMPLES:
+            return fetcher.HEDGE_DELAY
+
+        return latencies[min(len(latencies) - 1, int(len(latencies) * fetcher.HEDGE / 100))]
+
+
+class mirror:
+    # On-disk copy of every fetched url. It is served while younger than TTL,
+    # and served and revalidated in the background when older. Revalidation
+    # is a conditional request (ETag / Last-Modified) or, without validators,
+    # a count and last edit date probe.
+    ENABLED = False
+    OFFLINE = False
+    TTL = 3600  # seconds
+    THREADS = []
+
+    @staticmethod
+    def get(url, session=None):
+        entry = mirror.read(url)
+
+        if mirror.OFFLINE:
+            if entry is None:
+                raise FetchError(url, 'No mirrored data')
+
+            return dict(entry['jdata'])
+
+        if entry is None:
+            return mirror.fetch(url, session)
+
+        if time.time() - entry['time'] > mirror.TTL:
+            thread = Thread(target=mirror.fetch, args=(url, None, entry))
+            thread.start()
+            mirror.THREADS.append(thread)
+
+        return dict(entry['jdata'])  # the entry may still be written
+
+    @staticmethod
+    def fetch(url, session=None, entry=None):
+        try:
+            headers, probe = {}, None
+
+            if entry is not None and (entry['etag'] or entry['modified']):
+                headers = {
+                    k: v for k, v in (
+                        ('If-None-Match', entry['etag']),
+                        ('If-Modified-Since', entry['modified'])) if v}
+
+            elif entry is not None:
+                probe = mirror.probe(url, session)
+                if probe == entry['probe']:
+                    return mirror.touch(url, entry)
+
+            res, jdata = fetcher.get(url, session, lambda res: (
+                res, None if res.status_code == 304 else decode(url, res)), headers)
+
+            if res.status_code == 304:
+                return mirror.touch(url, entry)
+
+            jdata['features'] = list(get_features(
+                url, session, jdata, jdata.get('features', [])))
+
+            etag = res.headers.get('ETag')
+            modified = res.headers.get('Last-Modified')
+            if not (etag or modified) and probe is None:
+                probe = mirror.probe(url, session)
+
+            mirror.write(url, {
+                'url': url,
+                'time': time.time(),
+                'etag': etag,
+                'modified': modified,
+                'probe': probe,
+                'jdata': jdata})
+
+            return jdata
+
+        except FetchError as e:
+            if entry is None:
+                raise
 
-    except requests.exceptions.HTTPError as eh:
-        print("HTTPError:", eh)
+            print(u.error(), e, '- STALE DATA')
+            return entry['jdata']
 
-    except requests.exceptions.ConnectionError as ec:
-        print("ConnectionError:", ec)
+    @staticmethod
+    def join():
+        # revalidations started while serving stale data
+        for thread in mirror.THREADS:
+            thread.join()
+
+    @staticmethod
+    def probe_needed(url):
+        # only layer queries can be probed, not counts and statistics
+        return api.layer_of(url) is not None and api.COUNT not in url
+
+    @staticmethod
+    def probe(url, session=None):
+        if not mirror.probe_needed(url):
+            return None
+
+        meta = get_json(api.layer(api.layer_of(url)), session)
+        edited = meta.get('editingInfo', {}).get('lastEditDate')
+
+        return [get_json(url + api.COUNT, session)['count'], edited]
+
+    @staticmethod
+    def touch(url, entry):
+        entry['time'] = time.time()
+        mirror.write(url, entry)
+
+        return entry['jdata']
+
+    @staticmethod
+    def read(url):
+        return read_data(mirror.file(url))
+
+    @staticmethod
+    def write(url, entry):
+        file = mirror.file(url)
+        tmp = '{}.{}.tmp'.format(file, os.getpid())
+
+        try:
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            try:
+                with open(tmp, 'w') as f:
+                    json.dump(entry, f, ensure_ascii=False)
+                os.replace(tmp, file)  # readers never see a partial file
+
+            finally:
+                if os.path.isfile(tmp):  # any failed write
+                    os.remove(tmp)
+
+        except (OSError, IOError) as e:
+            print("IOError:", e)
+
+    @staticmethod
+    def file(url):
+        return '{}/{}.json'.format(C.MIRROR, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+
+class stream:
+    # Incremental decoder of a '{..., "features": [...], ...}' response body.
+    # Keys before features are read at once, features are yielded one at a
+    # time as they download and keys after features are added when the
+    # features are exhausted.
+    def __init__(self, res):
+        self.res = res
+        self.chunks = res.iter_content(chunk_size=C.CHUNK)
+        self.text = codecs.getincrementaldecoder('utf-8')()
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+
+    def decode(self):
+        jdata = {}
+        self.take('{')
+
+        for key in self.keys():
+            if key == 'features':
+                jdata[key] = self.features(jdata)
+                return jdata
+
+            jdata[key] = self.value()
+
+        jdata['features'] = iter([])
+        return jdata
+
+    def features(self, jdata):
+        self.take('[')
+
+        while self.peek() != ']':
+            if self.peek() == ',':
+                self.pos += 1
+
+            yield self.value()
+
+        self.pos += 1
+        for key in self.keys():
+            jdata[key] = self.value()
+
+        self.res.close()
+
+    def keys(self):
+        while True:
+            if self.peek() == ',':
+                self.pos += 1
+
+            if self.peek() == '}':
+                self.pos += 1
+                return
+
+            key = self.value()
+            self.take(':')
+
+            yield key
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+
+                # a number at the end of the buffer may continue in the next chunk
+                if end < len(self.buf) or not self.fill():
+                    self.pos = end
+                    return obj
+
+            except ValueError:
+                if not self.fill():
+                    raise
+
+    def take(self, c):
+        if self.peek() != c:
+            raise ValueError('Expecting {!r} at {}'.format(c, self.pos))
+
+        self.pos += 1
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+
+            if not self.fill():
+                raise ValueError('Unexpected end of response')
+
+    def fill(self):
+        for chunk in self.chunks:
+            text = self.text.decode(chunk)
+
+            if text:
+                self.buf = self.buf[self.pos:] + text
+                self.pos = 0
+                return True
 
-    except requests.exceptions.Timeout as et:
-        print("Timeout:", et)
+        return False
 
-    except requests.exceptions.RequestException as er:
-        print("RequestException:", er)
+
+class series:
+    # columnar time series: matrix[date, region] with date and region index
+    def __init__(self, dates, regions, matrix):
+        self.dates = dates
+        self.regions = regions
+        self.matrix = matrix
+        self.index = {r: i for i, r in enumerate(regions)}
+        self.lookup = series.build_lookup(regions)
+
+    @staticmethod
+    def build_lookup(regions):
+        # folded names and every unambiguous prefix of them -> region
+        prefixes = {}
+        for r in regions:
+            key = fold(r)
+            for i in range(1, len(key) + 1):
+                prefixes.setdefault(key[:i], set()).add(r)
+
+        lookup = {k: v.pop() for k, v in prefixes.items() if len(v) == 1}
+        lookup.update((fold(r), r) for r in regions)
+
+        return lookup
+
+    def resolve(self, REGION):
+        # regions of a comma separated query, None if any is unknown
+        regions = [self.lookup.get(fold(r)) for r in REGION.split(',')]
+        return None if None in regions or not regions else regions
+
+    def cumsum(self):
+        return self.matrix.cumsum(axis=0)
+
+    def totals(self):
+        return self.matrix.sum(axis=1)
+
+    def region_totals(self):
+        return self.matrix.sum(axis=0)
+
+    def to_dict(self):
+        return OrderedDict(
+            (date, OrderedDict(zip(self.regions, row)))
+            for date, row in zip(self.dates, self.matrix.tolist()))
+
+
+class metrics:
+    # 7-day average, 7-day incidence per 100 000 and week-over-week growth of
+    # the 7-day sum, for every region and the country (last column). A sum is
+    # NaN until window days exist, growth until two windows exist.
+    def __init__(self, data, window=7):
+        self.dates = list(data.dates)
+        self.regions = list(data.regions) + [C.SWEDEN]
+        self.index = {r: i for i, r in enumerate(self.regions)}
+        self.window = window
+        self.population = numpy.array(
+            [C.POPULATION.get(r, numpy.nan) for r in data.regions] +
+            [sum(C.POPULATION.values())], dtype=float)
+
+        matrix = numpy.hstack([data.matrix, data.totals()[:, None]]).astype(float)
+        cumsum = numpy.vstack([numpy.zeros((1, matrix.shape[1])), matrix.cumsum(axis=0)])
+
+        self.rows = matrix[-window:]  # the current window
+        self.sums = numpy.full(matrix.shape, numpy.nan)
+        if len(matrix) >= window:
+            self.sums[window - 1:] = cumsum[window:] - cumsum[:len(matrix) + 1 - window]
+        self.derive(0)
+
+    def derive(self, start):
+        # only rows from start onwards are (re)computed, growth of row t is
+        # against the sum of row t - window
+        sums = self.sums[start:]
+        before = numpy.full_like(sums, numpy.nan)
+        first = max(start, self.window)
+        if first < len(self.sums):
+            before[first - start:] = self.sums[first - self.window:len(self.sums) - self.window]
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            growth = numpy.where(before > 0, (sums / before - 1) * 100, numpy.nan)
+
+        average = sums / self.window
+        incidence = sums / self.population * C.PER
+
+        if start == 0:
+            self.average, self.incidence, self.growth = average, incidence, growth
+        else:
+            self.average = numpy.vstack([self.average[:start], average])
+            self.incidence = numpy.vstack([self.incidence[:start], incidence])
+            self.growth = numpy.vstack([self.growth[:start], growth])
+
+    def append(self, date, row):
+        # one new day (regions), only the window is summed
+        row = numpy.append(numpy.asarray(row, dtype=float), numpy.sum(row))
+        self.rows = numpy.vstack([self.rows, row])[-self.window:]
+
+        total = self.rows.sum(axis=0) if len(self.rows) == self.window \
+            else numpy.full(len(row), numpy.nan)
+        self.sums = numpy.vstack([self.sums, total])
+        self.dates.append(date)
+        self.derive(len(self.sums) - 1)
+
+    def column(self, name, REGION=None):
+        values = getattr(self, name)[:, self.index[C.SWEDEN if REGION is None else REGION]]
+        return [None if numpy.isnan(v) else round(v, 1) for v in values.tolist()]
+
+
+class output:
+    # writers of query sections (title: rows)
+    FORMAT = 'table'
+
+    @staticmethod
+    def render(sections):
+        return output.WRITERS[output.FORMAT](sections)
+
+    @staticmethod
+    def table(sections):
+        lines = []
+        for title, rows in sections.items():
+            lines.append(u.color.blue(title))
+            lines.extend(map(C.FORMAT.format, rows.keys(), (
+                '-' if v is None else v for v in rows.values())))
+            lines.append('')
+
+        return '\n'.join(lines[:-1]) + '\n' if lines else ''
+
+    @staticmethod
+    def csv(sections):
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator='\n')
+        writer.writerow(C.COLUMNS)
+
+        for title, rows in sections.items():
+            writer.writerows(zip(repeat(title), rows.keys(), rows.values()))
+
+        return buf.getvalue()
+
+    @staticmethod
+    def json(sections):
+        return json.dumps(sections, indent=4, ensure_ascii=False) + '\n'
+
+    @staticmethod
+    def ndjson(sections):
+        return ''.join(
+            json.dumps(OrderedDict(zip(C.COLUMNS, row)), ensure_ascii=False) + '\n'
+            for title, rows in sections.items()
+            for row in zip(repeat(title), rows.keys(), rows.values()))
+
+
+output.WRITERS = {
+    'table': output.table,
+    'csv': output.csv,
+    'json': output.json,
+    'ndjson': output.ndjson
+}
 
 
 class api:
-    URL = 'https://services5.arcgis.com/' \
-        'fsYDFeRKu1hELJJs/arcgis/rest/services/FOHM_Covid_19_FME_1/FeatureServer/'
-    PATH = '/query?f=json&outFields=*'
+    URL = os.environ.get(
+        'FHM_URL',
+        'https://services5.arcgis.com/'
+        'fsYDFeRKu1hELJJs/arcgis/rest/services/FOHM_Covid_19_FME_1/FeatureServer/')
+    LAYER = '?f=json'
+    STATS = '/query?f=json&where=1%3D1&outStatistics={}'
+    GROUP = '&groupByFieldsForStatistics={}'
+    FORMAT = 'json'
+    PBF = 'f=pbf'
+    PATH = '/query?f={}&outFields=*'
     ALL = '&where=1%3D1'
     REGIONS = '&where=Region <> \'dummy\'&returnGeometry=false'
+    LAYERS = [0, 1, 3, 4]  # 2: no data
+    COUNT = '&returnCountOnly=true'
+    ORDER = '&orderByFields={}'
+    PAGE = '&resultOffset={}&resultRecordCount={}'
+    OFFSET = '&resultOffset={}'
+
+    WHERE = '&where={}'
+    SINCE = 'Statistikdatum >= TIMESTAMP \'{}\''
+
+    @staticmethod
+    def url(n, where=None):
+        # ordered, so the first page and the pages after it are from one order
+        return '{}{}{}{}{}'.format(
+            api.URL,
+            str(n),
+            api.PATH.format(api.FORMAT),
+            api.WHERE.format(where) if where is not None
+            else (api.REGIONS if n == 0 else api.ALL),
+            api.ORDER.format(C.OID))
+
+    @staticmethod
+    def layer(n):
+        return '{}{}{}'.format(api.URL, str(n), api.LAYER)
+
+    @staticmethod
+    def layer_of(url):
+        m = re.match(re.escape(api.URL) + r'(\d+)/query', url)
+        return None if m is None else int(m.group(1))
+
+    @staticmethod
+    def stats(n, fields, stat='sum', group=None):
+        out = [{
+            'statisticType': stat,
+            'onStatisticField': f,
+            'outStatisticFieldName': f} for f in fields]
+
+        return '{}{}{}{}'.format(
+            api.URL,
+            str(n),
+            api.STATS.format(quote(json.dumps(out, ensure_ascii=False))),
+            api.GROUP.format(','.join(group)) if group else '')
 
     @staticmethod
-    def url(n):
-        return '{}{}{}{}'.format(api.URL, str(n), api.PATH, (api.REGIONS if n == 0 else api.ALL))
+    def since(ms):
+        dt = datetime.fromtimestamp(ms / 1000, timezone.utc)
+        return api.SINCE.format(dt.strftime('%Y-%m-%d %H:%M:%S'))
+
+    @staticmethod
+    def offset(url, offset):
+        return url + api.OFFSET.format(offset)
+
+    @staticmethod
+    def page(url, offset, size, oid):
+        order = '' if api.ORDER.format('') in url else api.ORDER.format(oid)
+        return url + api.PAGE.format(offset, size) + order
 
 
 class C:
+    SNAPSHOT = 'snapshot'
+    BATCH = 'batch'
+    INCREMENTAL = '-i'
+    PBF = '-p'
+    OUTPUT = '-o'
+    COLUMNS = ('section', 'key', 'value')
+    DIR = 'data'
+    MIRROR = 'data/mirror'
+    MIRROR_FLAG = '-m'
+    OFFLINE = '--offline'
+    HEDGE = '--hedge'
+    WATCH = '--watch'
+    INTERVAL = '--interval'
+    SOCKET = '--socket'
+    WAIT = 30  # seconds between watch probes
+    HOST = '127.0.0.1'
+    TTL = '-t'
+    OID = 'ObjectId'
+    DATE = 'Statistikdatum'
+    DEATHS_FIELD = 'Antal_avlidna'
+    TOTAL_DATE = 'TOTALT'
+    TOTAL = 'Totalt_antal_'
+    NOT_REGIONS = ('Totalt_', 'Kumulativa_', 'Antal_', OID, 'FID', DATE)
+    STRING = 'esriFieldTypeString'
+    INTEGER = 'esriFieldTypeInteger'
+    INTEGERS = (INTEGER, 'esriFieldTypeSmallInteger')
+    NPAGES = 8  # parallel page requests
+    STORED = {1: 'days', 3: 'genders', 4: 'age_groups'}
+    CHUNK = 1 << 16  # bytes per streamed read
+    ROW = '<i8'  # seen rows of layer 1 on disk
     DEATHS = "Antal avlidna"
+    TOTAL_CASES = 'Totalt antal fall'
+    DEATHS_MODES = (2, 6)
+    REGION_MODES = (1, 4, 7, 8, 9)
+    SWEDEN = 'Sverige'
+    PER = 100000
+    METRICS = {
+        'average': ' 7-DAGARSMEDEL',
+        'incidence': ' PER 100 000 (7 DAGAR)',
+        'growth': ' TILLVÄXT VECKA (%)'
+    }
+    POPULATION = {  # SCB, 2019-12-31
+        'Blekinge': 159606,
+        'Dalarna': 287966,
+        'Gotland': 59686,
+        'Gävleborg': 287382,
+        'Halland': 333848,
+        'Jämtland Härjedalen': 130810,
+        'Jönköping': 363599,
+        'Kalmar': 245446,
+        'Kronoberg': 201469,
+        'Norrbotten': 250093,
+        'Skåne': 1377827,
+        'Stockholm': 2377081,
+        'Sörmland': 297540,
+        'Uppsala': 383713,
+        'Värmland': 282414,
+        'Västerbotten': 271736,
+        'Västernorrland': 245347,
+        'Västmanland': 275845,
+        'Västra Götaland': 1725881,
+        'Örebro': 304805,
+        'Östergötland': 465495
+    }
     FORMAT = '{:<20}{:>15}'
-    USAGE = 'Usage: ./fhm_hax.py 0 [0..2] | 1 0|1|3|4|5 [REGION] | 1 2|6 | 2 | 3 | 4 [0..2]\n' \
+    USAGE = 'Usage: ./fhm_hax.py 0 [0..2] | 1 0|1|3|4|5|7|8|9 [REGION] | 1 2|6 | 2 | 3 | 4 [0..2]' \
+        ' | snapshot [LAYER..] | batch [QUERY..]\n' \
+        '\n-i: Incremental, only fetch new days of 1 (seen days in data/)' \
+        '\n-p: Fetch layers as protocol buffers (f=pbf) instead of json' \
+        '\n-o table|csv|json|ndjson: Output format, table by default' \
+        '\n-m: Serve layers from the local mirror (data/mirror/), revalidated when stale' \
+        '\n-t SECONDS: Time the mirror is fresh, 3600 by default' \
+        '\n--offline: Only serve from the local mirror, never touch the network' \
+        '\n--hedge PERCENTILE: Send a duplicate request when one is slower than the percentile' \
+        '\n--watch [LAYER..]: Poll the layers, changed cells as NDJSON lines' \
+        '\n--interval SECONDS: Time between polls, 30 by default' \
+        '\n--socket PORT: Serve the lines on 127.0.0.1:PORT instead of stdout' \
+        '\n' \
         '\n0: Total per region' \
             '\n\t\t0: Sort by "Fall"' \
             '\n\t\t1: Sort by "Intensivvårdade"' \
@@ -325,16 +1530,39 @@ class C:
             '\n\t\t4: Total cases per date per region' \
             '\n\t\t5: Total per region' \
             '\n\t\t6: Total deaths per date' \
+            '\n\t\t7: 7-day average of new cases per date [per region]' \
+            '\n\t\t8: New cases per 100 000 over 7 days per date [per region]' \
+            '\n\t\t9: Week-over-week growth (%) per date [per region]' \
         '\n2: No data yet' \
         '\n3: Total per gender' \
         '\n4: Total per age group' \
             '\n\t\t0: Sort by "Fall"' \
             '\n\t\t1: Sort by "Intensivvårdade"' \
             '\n\t\t2: Sort by "Avlidna"' \
+        '\nsnapshot: Layers 0, 1, 3 and 4 (or given layers) fetched concurrently as JSON' \
+        '\nbatch: Queries from arguments (or stdin, one per line), each layer fetched once' \
         '\n\nExamples:' \
             '\n\t\t./fhm.py 0 1' \
-            '\n\t\t./fhm.py 1 1 Västra Götaland'
+            '\n\t\t./fhm.py 1 1 Västra Götaland' \
+            '\n\t\t./fhm.py 1 4 vastra got, skane, stock' \
+            '\n\t\t./fhm.py -o json batch "0 1" "1 1 Stockholm" "1 6"'
+
+    @staticmethod
+    def file(n):
+        return '{}/layer-{}.json'.format(C.DIR, n)
+
+    @staticmethod
+    def rows(n):
+        return '{}/layer-{}.rows'.format(C.DIR, n)
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+
+    except FetchError as e:
+        print(u.error(), e)
+        sys.exit(1)
+
+    finally:
+        mirror.join()
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+from datetime import datetime
+from sys import argv
+import utils as u
+import hashlib
+import json
+import os
+
+
+# Append-only archive of every fetched history of new cases per date, from
+# fhm.py (layer 1) and fhm_scraper.py. Every date is a chunk named by the hash
+# of its content, so a day that is not revised is stored once, and a snapshot
+# is a line in the log of its source mapping its dates to their chunks:
+#   data/archive/<source>.ndjson    {"time", "source", "hash", "chunks"}
+#   data/archive/chunks/<sha1>.json {"date", "cells"}
+# The sources have columns of their own, snapshots are only compared within
+# one. A diff only reads the chunks of the dates whose hashes differ.
+#   $ ./fhm_archive.py [SOURCE]              snapshots, of fhm by default
+#   $ ./fhm_archive.py [SOURCE] diff [A [B]] changed cells, -2 and -1 by default
+def main():
+    source = argv.pop(1) if argv[1:2] and argv[1] in C.SOURCES else C.SOURCES[0]
+
+    if argv[1:2] == ['diff']:
+        a, b = (argv[2:] + C.DIFF[len(argv[2:]):])[:2]
+        print_diff(diff(get_snapshot(a, source), get_snapshot(b, source)))
+    elif len(argv) == 1:
+        print_snapshots(read_snapshots(source))
+    else:
+        print(C.USAGE)
+        quit()
+
+
+def add(history, source, DELTA=False):
+    # history: {date: {column: value}}, a line is only appended on a change.
+    # A DELTA only holds new and revised dates, the others are kept from the
+    # last snapshot.
+    chunks = OrderedDict(
+        (date, write_chunk(date, cells)) for date, cells in history.items())
+
+    last = read_last(source)
+    if DELTA and last is not None:
+        chunks = OrderedDict(list(last['chunks'].items()) + list(chunks.items()))
+
+    key = get_hash(chunks)
+    if last is not None and last['hash'] == key:
+        return last
+
+    snapshot = OrderedDict([
+        ('time', datetime.now().strftime('%y-%m-%d %H:%M:%S')),
+        ('source', source),
+        ('hash', key),
+        ('chunks', chunks)])
+
+    try:
+        os.makedirs(C.DIR, exist_ok=True)
+        with open(C.log(source), 'a') as f:
+            f.write(json.dumps(snapshot, ensure_ascii=False) + '\n')
+
+    except (OSError, IOError) as e:
+        print("IOError:", e)
+
+    return snapshot
+
+
+def diff(a, b):
+    # (date, column, old, new) of every changed cell, None when missing
+    changes = []
+
+    for date in sorted(set(a['chunks']) | set(b['chunks'])):
+        old, new = a['chunks'].get(date), b['chunks'].get(date)
+        if old == new:
+            continue
+
+        old, new = read_chunk(old), read_chunk(new)
+        for column in list(old) + [k for k in new if k not in old]:
+            if old.get(column) != new.get(column):
+                changes.append((date, column, old.get(column), new.get(column)))
+
+    return changes
+
+
+def get_snapshot(ref, source):
+    # by index, negative from the newest, or by a prefix of its hash
+    snapshots = read_snapshots(source)
+
+    try:
+        return snapshots[int(ref)]
+
+    except ValueError:
+        matches = [s for s in snapshots if s['hash'].startswith(ref)]
+        if len(matches) == 1:
+            return matches[0]
+
+    except IndexError:
+        pass
+
+    print(u.error(), 'NO SUCH SNAPSHOT:', ref)
+    quit()
+
+
+def write_chunk(date, cells):
+    content = OrderedDict([('date', date), ('cells', cells)])
+    key = get_hash(content)
+    file = C.file(key)
+
+    if not os.path.isfile(file):
+        tmp = '{}.{}.tmp'.format(file, os.getpid())
+
+        try:
+            os.makedirs(C.CHUNKS, exist_ok=True)
+            with open(tmp, 'w') as f:
+                json.dump(content, f, ensure_ascii=False)
+            os.replace(tmp, file)
+
+        except (OSError, IOError) as e:
+            print("IOError:", e)
+
+    return key
+
+
+def read_chunk(key):
+    if key is None:
+        return {}
+
+    with open(C.file(key), 'r') as f:
+        return json.load(f, object_pairs_hook=OrderedDict)['cells']
+
+
+def read_snapshots(source):
+    if not os.path.isfile(C.log(source)):
+        return []
+
+    with open(C.log(source), 'r') as f:
+        return [json.loads(l, object_pairs_hook=OrderedDict) for l in f if l.strip()]
+
+
+def read_last(source):
+    # the last line only, read backwards from the end of the log
+    if not os.path.isfile(C.log(source)):
+        return None
+
+    with open(C.log(source), 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        pos, buf = end, b''
+
+        while pos > 0 and buf.count(b'\n') < 2:
+            pos = max(0, pos - C.TAIL)
+            f.seek(pos)
+            buf = f.read(end - pos)
+
+    lines = buf.decode('utf-8').strip().split('\n')
+    return json.loads(lines[-1]) if lines[-1] else None
+
+
+def get_hash(content):
+    text = json.dumps(content, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def print_snapshots(snapshots):
+    print(C.SNAPSHOTS.format('', 'TIME', 'SOURCE', 'DATES', 'HASH'))
+
+    for i, s in enumerate(snapshots):
+        print(C.SNAPSHOTS.format(
+            i, s['time'], s['source'], len(s['chunks']), s['hash'][:C.SHORT]))
+
+
+def print_diff(changes):
+    if not changes:
+        print(u.info(), 'NO CHANGES')
+        return
+
+    print(C.CHANGES.format('DATE', 'COLUMN', 'OLD', 'NEW'))
+    for date, column, old, new in changes:
+        print(C.CHANGES.format(
+            date, column, '-' if old is None else old, '-' if new is None else new))
+
+
+class C:
+    DIR = 'data/archive'
+    CHUNKS = 'data/archive/chunks'
+    SOURCES = ['fhm', 'scraper']
+    DIFF = ['-2', '-1']
+    TAIL = 1 << 16  # bytes read per step from the end of the log
+    SHORT = 10
+    SNAPSHOTS = '{:>4}  {:20}{:10}{:>6}  {}'
+    CHANGES = '{:10}{:26}{:>10}{:>10}'
+    USAGE = 'Usage: ./fhm_archive.py [fhm|scraper] [diff [SNAPSHOT [SNAPSHOT]]]'
+
+    @staticmethod
+    def file(key):
+        return '{}/{}.json'.format(C.CHUNKS, key)
+
+    @staticmethod
+    def log(source):
+        return '{}/{}.ndjson'.format(C.DIR, source)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from modules.selenium import webdriver
+from modules.selenium.webdriver.chrome.remote_connection import ChromeRemoteConnection
+from sys import argv
+import utils as u
+import fhm_scraper
+import signal
+import json
+import time
+import sys
+import os
+
+
+# Keeps a headless Chrome with the dashboard loaded between scraper runs, so
+# a scrape attaches to a warm session instead of starting a browser:
+#   $ ./fhm_browser.py &
+#   $ ./fhm_scraper.py
+#   $ ./fhm_browser.py stop
+# The page is reloaded after every scrape and every RELOAD seconds. A scrape
+# and a reload never overlap, both hold data/browser.lock.
+def main():
+    if argv[1:] in ([], ['start']):
+        serve()
+    elif argv[1:] == ['stop']:
+        stop()
+    else:
+        print(C.USAGE)
+        quit()
+
+
+def serve():
+    print(u.debug(), 'LOADING DRIVER...')
+    driver = fhm_scraper.build_driver(True)  # performance log, for -n
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    try:
+        load(driver)
+        write_state({
+            'url': driver.service.service_url,
+            'session': driver.session_id,
+            'w3c': driver.w3c,
+            'pid': os.getpid()})
+        print(u.info(), 'SESSION {} ON {}'.format(driver.session_id, driver.service.service_url))
+
+        loaded = time.time()
+        while True:
+            time.sleep(C.POLL)
+
+            stale = os.path.isfile(C.DIRTY) or time.time() - loaded > C.RELOAD
+            if stale and acquire():
+                try:
+                    load(driver)
+                    loaded = time.time()
+                    remove(C.DIRTY)
+
+                finally:
+                    release()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        remove(C.STATE)
+        driver.quit()
+
+
+def load(driver):
+    # a fresh page, with only its own requests in the performance log
+    driver.get_log('performance')
+    driver.get(fhm_scraper.api.API)
+    fhm_scraper.get_element(driver, fhm_scraper.C.TABLE_ID)
+
+
+def stop():
+    state = read_state()
+    if state is None:
+        print(u.error(), 'NO BROWSER RUNNING')
+        quit()
+
+    os.kill(state['pid'], signal.SIGTERM)
+
+
+def attach():
+    # the warm session, None without a broker or while it is busy
+    state = read_state()
+    if state is None or not alive(state['pid']) or not acquire():
+        return None
+
+    try:
+        driver = attached(state)
+        if os.path.isfile(C.DIRTY):  # paged by the last scrape, not reloaded yet
+            load(driver)
+            remove(C.DIRTY)
+        else:
+            driver.current_url  # the session is still there
+
+        return driver
+
+    except Exception:  # any failure leaves a fresh browser to the scraper
+        release()
+        return None
+
+
+class attached(webdriver.Remote):
+    # Remote driver on the broker's session, without starting a new one.
+    # Quitting hands the page back to the broker for a reload.
+    def __init__(self, state):
+        self.state = state
+        webdriver.Remote.__init__(
+            self, command_executor=ChromeRemoteConnection(state['url']))
+
+    def start_session(self, capabilities, browser_profile=None):
+        self.session_id = self.state['session']
+        self.w3c = self.command_executor.w3c = self.state['w3c']
+
+    def execute_cdp_cmd(self, cmd, cmd_args):
+        return self.execute(
+            'executeCdpCommand', {'cmd': cmd, 'params': cmd_args})['value']
+
+    def quit(self):
+        open(C.DIRTY, 'w').close()
+        release()
+
+
+def acquire():
+    # the lock holds its pid, the lock of a dead process is taken over
+    os.makedirs(C.DIR, exist_ok=True)
+
+    for _ in range(2):
+        try:
+            fd = os.open(C.LOCK, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.write(fd, str(os.getpid()).encode('utf-8'))
+            os.close(fd)
+            return True
+
+        except FileExistsError:
+            try:
+                with open(C.LOCK, 'r') as f:
+                    pid = int(f.read())
+
+            except (OSError, ValueError):
+                return False  # being written
+
+            if alive(pid):
+                return False
+
+            remove(C.LOCK)
+
+    return False
+
+
+def release():
+    remove(C.LOCK)
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+
+    except ProcessLookupError:
+        return False
+
+    except PermissionError:
+        return True
+
+
+def read_state():
+    try:
+        with open(C.STATE, 'r') as f:
+            return json.load(f)
+
+    except (OSError, ValueError):
+        return None
+
+
+def write_state(state):
+    os.makedirs(C.DIR, exist_ok=True)
+    with open(C.STATE, 'w') as f:
+        json.dump(state, f)
+
+
+def remove(file):
+    try:
+        os.remove(file)
+
+    except FileNotFoundError:
+        pass
+
+
+class C:
+    DIR = 'data'
+    STATE = 'data/browser.json'
+    LOCK = 'data/browser.lock'
+    DIRTY = 'data/browser.dirty'
+    POLL = 1  # seconds between checks for a reload
+    RELOAD = 600  # seconds a loaded page is kept
+    USAGE = 'Usage: ./fhm_browser.py [start|stop]'
+
+
+if __name__ == "__main__":
+    main()
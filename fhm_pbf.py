@@ -0,0 +1,321 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+from struct import Struct
+
+
+# Pure Python decoder (and encoder, for fhm_stub.py) of the FeatureServer's
+# f=pbf response, esriPBuffer.FeatureCollectionPBuffer. Decodes into the same
+# shape as the f=json response, so the fhm.py parsers read it unchanged.
+#
+#   FeatureCollectionPBuffer  1: version, 2: queryResult
+#   QueryResult               1: featureResult, 2: countResult, 3: idsResult
+#   FeatureResult             1: objectIdFieldName, 7: geometryType,
+#                             9: exceededTransferLimit, 12: transform,
+#                             13: fields, 15: features
+#   Field                     1: name, 2: fieldType, 3: alias
+#   Feature                   1: attributes (Value), 2: geometry, 4: centroid
+#   Geometry                  2: lengths (packed), 3: coords (packed, delta)
+#   Value                     1: string, 2: float, 3: double, 4: sint32,
+#                             5: uint32, 6: int64, 7: uint64, 8: sint64,
+#                             9: bool
+def decode(buf):
+    jdata = OrderedDict()
+    buf = memoryview(buf)
+
+    for n, _, v in read(buf):
+        if n == 2:
+            for n, _, v in read(v):
+                if n == 1:
+                    return decode_features(v)
+                elif n == 2:
+                    return {'count': next(
+                        (v for n, _, v in read(v) if n == 1), 0)}
+                elif n == 3:
+                    return decode_ids(v)
+
+    return jdata
+
+
+def decode_features(buf):
+    jdata = OrderedDict()
+    fields, features = [], []
+    transform = None
+    geometry_type = 127
+
+    for n, _, v in read(buf):
+        if n == 1:
+            jdata['objectIdFieldName'] = text(v)
+        elif n == 7:
+            geometry_type = v
+        elif n == 9:
+            jdata['exceededTransferLimit'] = bool(v)
+        elif n == 12:
+            transform = decode_transform(v)
+        elif n == 13:
+            fields.append(decode_field(v))
+        elif n == 15:
+            features.append(v)
+
+    if geometry_type in C.GEOMETRY_TYPES:
+        jdata['geometryType'] = C.GEOMETRY_TYPES[geometry_type]
+
+    jdata['fields'] = fields
+    names = [f['name'] for f in fields]
+    jdata['features'] = [
+        decode_feature(f, names, geometry_type, transform) for f in features]
+
+    return jdata
+
+
+def decode_ids(buf):
+    jdata = OrderedDict()
+    jdata['objectIds'] = []
+
+    for n, wt, v in read(buf):
+        if n == 1:
+            jdata['objectIdFieldName'] = text(v)
+        elif n == 3:
+            jdata['objectIds'] += packed(v) if wt == 2 else [v]
+
+    return jdata
+
+
+def decode_field(buf):
+    field = OrderedDict()
+
+    for n, _, v in read(buf):
+        if n == 1:
+            field['name'] = text(v)
+        elif n == 2:
+            field['type'] = C.FIELD_TYPES.get(v, C.FIELD_TYPES[4])
+        elif n == 3:
+            field['alias'] = text(v)
+
+    field.setdefault('type', C.FIELD_TYPES[0])  # default enum value
+
+    return field
+
+
+def decode_feature(buf, names, geometry_type, transform):
+    values, geometry = [], None
+
+    for n, _, v in read(buf):
+        if n == 1:
+            values.append(decode_value(v))
+        elif n == 2 and transform is not None:
+            geometry = decode_geometry(v, geometry_type, transform)
+
+    feature = {'attributes': OrderedDict(zip(names, values))}
+    if geometry is not None:
+        feature['geometry'] = geometry
+
+    return feature
+
+
+def decode_value(buf):
+    for n, wt, v in read(buf):
+        if n == 1:
+            return text(v)
+        elif n == 2:
+            return C.FLOAT.unpack(v)[0]
+        elif n == 3:
+            return C.DOUBLE.unpack(v)[0]
+        elif n == 4 or n == 8:
+            return unzigzag(v)
+        elif n == 6:
+            return v - (1 << 64) if v >= 1 << 63 else v
+        elif n == 9:
+            return bool(v)
+        else:
+            return v
+
+    return None  # an empty value is a null
+
+
+def decode_transform(buf):
+    transform = {'origin': 0, 'scale': [1.0, 1.0], 'translate': [0.0, 0.0]}
+
+    for n, _, v in read(buf):
+        if n == 1:
+            transform['origin'] = v
+        elif n == 2 or n == 3:
+            xy = transform['scale' if n == 2 else 'translate']
+            for i, _, d in read(v):
+                if i <= 2:
+                    xy[i - 1] = C.DOUBLE.unpack(d)[0]
+
+    return transform
+
+
+def decode_geometry(buf, geometry_type, transform):
+    # coordinates are quantized integers, delta encoded against the previous
+    lengths, coords = [], []
+
+    for n, wt, v in read(buf):
+        if n == 2:
+            lengths += packed(v) if wt == 2 else [v]
+        elif n == 3:
+            coords += [unzigzag(c) for c in (packed(v) if wt == 2 else [v])]
+
+    (sx, sy), (tx, ty) = transform['scale'], transform['translate']
+    upper_left = transform['origin'] == 0
+    points, x, y = [], 0, 0
+
+    for i in range(0, len(coords) - 1, 2):
+        x += coords[i]
+        y += coords[i + 1]
+        points.append([
+            x * sx + tx,
+            ty - y * sy if upper_left else y * sy + ty])
+
+    if geometry_type == 0:
+        return {'x': points[0][0], 'y': points[0][1]} if points else None
+    if geometry_type == 1:
+        return {'points': points}
+
+    parts, start = [], 0
+    for length in lengths or [len(points)]:
+        parts.append(points[start:start + length])
+        start += length
+
+    return {'paths' if geometry_type == 2 else 'rings': parts}
+
+
+def read(buf):
+    # (field number, wire type, value) of every field in a message
+    i, end = 0, len(buf)
+
+    while i < end:
+        key, i = varint(buf, i)
+        n, wt = key >> 3, key & 7
+
+        if wt == 0:
+            v, i = varint(buf, i)
+        elif wt == 1:
+            v, i = buf[i:i + 8], i + 8
+        elif wt == 2:
+            length, i = varint(buf, i)
+            v, i = buf[i:i + length], i + length
+        elif wt == 5:
+            v, i = buf[i:i + 4], i + 4
+        else:
+            raise ValueError('Unsupported wire type {}'.format(wt))
+
+        yield n, wt, v
+
+
+def varint(buf, i):
+    result = shift = 0
+
+    while True:
+        b = buf[i]
+        i += 1
+        result |= (b & 0x7f) << shift
+
+        if b < 0x80:
+            return result, i
+
+        shift += 7
+
+
+def packed(buf):
+    values, i = [], 0
+
+    while i < len(buf):
+        v, i = varint(buf, i)
+        values.append(v)
+
+    return values
+
+
+def unzigzag(v):
+    return (v >> 1) ^ -(v & 1)
+
+
+def text(buf):
+    return bytes(buf).decode('utf-8')
+
+
+def encode(jdata):
+    # FeatureCollectionPBuffer of a json response, attributes only
+    if 'count' in jdata:
+        result = message(2, message(1, uvarint(jdata['count']), 0))
+    else:
+        types = {v: k for k, v in C.FIELD_TYPES.items()}
+        names = [f['name'] for f in jdata['fields']]
+
+        result = b''
+        if 'objectIdFieldName' in jdata:
+            result += message(1, jdata['objectIdFieldName'].encode('utf-8'))
+        if jdata.get('exceededTransferLimit'):
+            result += message(9, uvarint(1), 0)
+
+        for f in jdata['fields']:
+            result += message(13, message(1, f['name'].encode('utf-8')) +
+                              message(2, uvarint(types.get(f['type'], 4)), 0))
+
+        for f in jdata['features']:
+            result += message(15, b''.join(
+                message(1, encode_value(f['attributes'].get(name)))
+                for name in names))
+
+        result = message(1, result)
+
+    return message(2, result)
+
+
+def encode_value(v):
+    if v is None:
+        return b''
+    if isinstance(v, bool):
+        return message(9, uvarint(int(v)), 0)
+    if isinstance(v, int):
+        return message(8, uvarint((v << 1) ^ (v >> 63)), 0)
+    if isinstance(v, float):
+        return message(3, C.DOUBLE.pack(v), 1)
+
+    return message(1, str(v).encode('utf-8'))
+
+
+def message(n, payload, wt=2):
+    key = uvarint(n << 3 | wt)
+    return key + (uvarint(len(payload)) + payload if wt == 2 else payload)
+
+
+def uvarint(v):
+    out = bytearray()
+
+    while v > 0x7f:
+        out.append(v & 0x7f | 0x80)
+        v >>= 7
+    out.append(v)
+
+    return bytes(out)
+
+
+class C:
+    FLOAT = Struct('<f')
+    DOUBLE = Struct('<d')
+    GEOMETRY_TYPES = {
+        0: 'esriGeometryPoint',
+        1: 'esriGeometryMultipoint',
+        2: 'esriGeometryPolyline',
+        3: 'esriGeometryPolygon'
+    }
+    FIELD_TYPES = {
+        0: 'esriFieldTypeSmallInteger',
+        1: 'esriFieldTypeInteger',
+        2: 'esriFieldTypeSingle',
+        3: 'esriFieldTypeDouble',
+        4: 'esriFieldTypeString',
+        5: 'esriFieldTypeDate',
+        6: 'esriFieldTypeOID',
+        7: 'esriFieldTypeGeometry',
+        8: 'esriFieldTypeBlob',
+        9: 'esriFieldTypeRaster',
+        10: 'esriFieldTypeGUID',
+        11: 'esriFieldTypeGlobalID',
+        12: 'esriFieldTypeXML'
+    }
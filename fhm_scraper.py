@@ -5,22 +5,31 @@ import os
 import sys
 import json
 import time
+import base64
 import utils as u
 from datetime import datetime, date
 from collections import OrderedDict, Counter
 
-from modules.bs4 import BeautifulSoup
 from modules.sortedcontainers import SortedSet, SortedDict
 
-from modules.selenium import webdriver
-from modules.selenium.webdriver.common.by import By
-from modules.selenium.webdriver.support.ui import WebDriverWait
-from modules.selenium.webdriver.support import expected_conditions as ec
-from modules.selenium.common.exceptions import TimeoutException
+# imported on first use, saved data is printed without loading the driver
+webdriver = u.lazy('modules.selenium.webdriver')
+by = u.lazy('modules.selenium.webdriver.common.by')
+ui = u.lazy('modules.selenium.webdriver.support.ui')
+ec = u.lazy('modules.selenium.webdriver.support.expected_conditions')
+exceptions = u.lazy('modules.selenium.common.exceptions')
+fhm = u.lazy('fhm')
+fhm_archive = u.lazy('fhm_archive')
+fhm_store = u.lazy('fhm_store')
+fhm_browser = u.lazy('fhm_browser')
+fhm_pbf = u.lazy('fhm_pbf')
+futures = u.lazy('concurrent.futures')
 
 
 def main():
     t0 = time.time()
+    NETWORK = C.NETWORK in sys.argv[1:]
+    WORKERS = get_workers()
     data = read_data()
 
     if data is not None:
@@ -33,22 +42,36 @@ def main():
     try:
         print(u.debug(), 'LOADING DRIVER...')
         t1 = time.time()
-        driver = build_driver()
-        driver.get(api.API)
-        print_elapsed_time('DRIVER LOADED:', t1)
+        driver = fhm_browser.attach()  # a warm session of ./fhm_browser.py
+
+        if driver is None:
+            driver = build_driver(NETWORK)
+            driver.get(api.API)
+            print_elapsed_time('DRIVER LOADED:', t1)
+        else:
+            print_elapsed_time('DRIVER ATTACHED:', t1)
 
         print(u.debug(), 'LOOKING FOR ELEMENTS...')
         t2 = time.time()
         table = get_element(driver, C.TABLE_ID)
-        button = get_element(driver, C.BUTTON_ID, True)
-        pagination = get_element(driver, C.PAGINATION_ID)
-        ndays = parse_pagination(pagination)
-        print_elapsed_time('ELEMENTS FOUND:', t2)
 
-        print(u.debug(), 'SCRAPING DATA...')
-        t3 = time.time()
-        data = scrape_data(table, button, ndays)
-        print_elapsed_time('DATA SCRAPED:', t3)
+        if NETWORK:  # the table is loaded, so are the queries behind it
+            data = capture_data(driver)
+            print_elapsed_time('QUERIES CAPTURED:', t2)
+
+            if not data:
+                print(u.error(), 'NO QUERY RESPONSES CAPTURED, PAGING...')
+
+        if not data:
+            button = get_element(driver, C.BUTTON_ID, True)
+            pagination = get_element(driver, C.PAGINATION_ID)
+            ndays = parse_pagination(pagination)
+            print_elapsed_time('ELEMENTS FOUND:', t2)
+
+            print(u.debug(), 'SCRAPING DATA...')
+            t3 = time.time()
+            data = scrape_parallel(driver, table, button, ndays, WORKERS)
+            print_elapsed_time('DATA SCRAPED:', t3)
 
     finally:
         driver.quit()
@@ -71,31 +94,193 @@ def ask(data):
         print_json(data)
 
 
-def scrape_data(table, button, ndays):
+def scrape_data(driver, table, button, ndays):
     data = SortedDict()
+    page = driver.execute_script(C.READ_TABLE, table)
 
     for i in range(ndays):
-        html = table.get_attribute('innerHTML')
-        soup = BeautifulSoup(html, 'html.parser')
-        rows = soup.find_all('tr')
-
-        dt = rows[0].find_all('td')[1].text
-        date = format_date(dt)
+        date = format_date(page['date'])
 
         data[date] = OrderedDict()
 
-        for row in rows[1:]:
-            col = row.find_all('td')
-            region = col[0].text
-            n = int(col[1].text.replace(',', ''))
+        for region, n in page['rows']:
+            data[date][region] = int(n.replace(',', ''))
+
+        if i < ndays - 1:
+            page = next_page(driver, table, button)
+
+            if page is None:
+                print(u.error(), 'PAGE DID NOT CHANGE AFTER', date)
+                break
+
+    return data
+
+
+def next_page(driver, table, button, clicks=1):
+    # One round trip per page, or per CLICKS pages of a jump: clicked in the
+    # browser, read once a MutationObserver saw the table render, None if it
+    # did not in time.
+    page = None
+
+    while clicks > 0:
+        n = min(clicks, C.CLICKS)
+        try:
+            page = driver.execute_async_script(
+                C.NEXT_PAGE, table, button, n, C.PAGE_TIMEOUT * 1000)
+
+        except exceptions.TimeoutException:
+            page = None
+
+        if page is None:
+            return None
+
+        clicks -= n
+
+    return page
+
+
+def scrape_parallel(driver, table, button, ndays, nworkers=1):
+    # The pages are split in ranges, the first is read with the driver and
+    # the others each with a browser of their own, at the same time. A
+    # browser clicks through the pages before its range, so the last one
+    # still renders about ndays pages, only the reads are split.
+    bounds = [ndays * i // nworkers for i in range(nworkers + 1)]
+    ranges = [(a, b) for a, b in zip(bounds, bounds[1:]) if a < b]
+
+    def scrape(i):
+        start, end = ranges[i]
+        if i == 0:
+            return scrape_range(driver, table, button, start, end)
+
+        d = build_driver()
+        try:
+            d.get(api.API)
+            return scrape_range(
+                d, get_element(d, C.TABLE_ID), get_element(d, C.BUTTON_ID, True),
+                start, end)
+
+        finally:
+            d.quit()
+
+    with futures.ThreadPoolExecutor(max_workers=max(len(ranges), 1)) as executor:
+        parts = list(executor.map(scrape, range(len(ranges))))
+
+    # merged in page order, a date read twice keeps its first read
+    data = SortedDict()
+    for part in parts:
+        for date, rows in part.items():
+            data.setdefault(date, rows)
+
+    # an incomplete history is not saved
+    missing = [(a, b) for (a, b), part in zip(ranges, parts) if len(part) != b - a]
+    if missing or len(data) != ndays:
+        print(u.error(), 'PAGES NOT READ:', ', '.join(
+            '{}-{}'.format(a + 1, b) for a, b in missing) or
+            '{} OF {} DAYS'.format(len(data), ndays))
+        quit()
+
+    return data
+
 
-            data[date][region] = n
+def scrape_range(driver, table, button, start, end):
+    # pages start..end-1, jumped to in scripts of CLICKS pages
+    driver.set_script_timeout(C.SCRIPT_TIMEOUT)
+    if start and next_page(driver, table, button, start) is None:
+        print(u.error(), 'CAN NOT SKIP TO PAGE', start + 1)
+        return SortedDict()
 
-        button.click()
+    return scrape_data(driver, table, button, end - start)
+
+
+def get_workers():
+    if C.WORKERS_FLAG not in sys.argv:
+        return C.WORKERS
+
+    try:
+        i = sys.argv.index(C.WORKERS_FLAG)
+        workers = int(sys.argv[i + 1])
+        del sys.argv[i:i + 2]
+
+        if workers < 1:
+            raise ValueError
+
+        return workers
+
+    except (IndexError, ValueError):
+        print(C.USAGE)
+        quit()
+
+
+def capture_data(driver):
+    # new cases per date and region from the dashboard's own query responses,
+    # in the shape of scrape_data
+    data = SortedDict()
+
+    for payload in get_payloads(driver):
+        for f in payload.get('features', []):
+            attributes = f.get('attributes', {})
+            if fhm.C.DATE not in attributes or C.TOTAL not in attributes:
+                continue
+
+            keys, regions = fhm.plan_regions(fhm.get_fields(payload, attributes))
+            date = fhm.format_date(attributes[fhm.C.DATE])
+
+            data[date] = OrderedDict(
+                zip(regions, (attributes[k] or 0 for k in keys)))
+            data[date]['Totalt'] = attributes[C.TOTAL] or 0
 
     return data
 
 
+def get_payloads(driver):
+    # Bodies of the FeatureServer queries in the performance log, read over
+    # the DevTools protocol once loaded, until the log stays quiet.
+    payloads, urls = [], {}
+    deadline = time.time() + C.CAPTURE_TIMEOUT
+
+    while time.time() < deadline:
+        entries = driver.get_log('performance')
+
+        for entry in entries:
+            message = json.loads(entry['message'])['message']
+            params = message.get('params', {})
+
+            if message['method'] == 'Network.responseReceived':
+                url = params['response']['url']
+                if C.FEATURE_SERVER in url and C.QUERY in url:
+                    urls[params['requestId']] = url
+
+            elif message['method'] == 'Network.loadingFinished' and \
+                    params['requestId'] in urls:
+                payload = get_payload(
+                    driver, params['requestId'], urls.pop(params['requestId']))
+                if payload is not None:
+                    payloads.append(payload)
+
+        if payloads and not entries and not urls:
+            break
+
+        time.sleep(C.POLL)
+
+    return payloads
+
+
+def get_payload(driver, request_id, url):
+    try:
+        res = driver.execute_cdp_cmd(
+            'Network.getResponseBody', {'requestId': request_id})
+        body = base64.b64decode(res['body']) if res.get('base64Encoded') \
+            else res['body'].encode('utf-8')
+
+        if 'f=pbf' in url:
+            return fhm_pbf.decode(body)
+
+        return json.loads(body.decode('utf-8'))
+
+    except (exceptions.WebDriverException, ValueError, IndexError) as e:
+        print(u.error(), 'CAN NOT READ RESPONSE:', url, e)
+
+
 def parse_data(data):
     parsed = OrderedDict()
     parsed['NEW_CASES_PER_DAY_REGIONS'] = data
@@ -122,11 +307,14 @@ def parse_time_series(data, TOTAL=False, REGION=None):
     return progress
 
 
-def build_driver():
+def build_driver(NETWORK=False):
     # prepare the option for the chrome driver
     options = webdriver.ChromeOptions()
     options.add_argument('--headless')
     options.add_argument("--disable-webgl")
+    if NETWORK:  # network events in the performance log
+        options.set_capability('loggingPrefs', {'performance': 'ALL'})
+        options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
 
     chrome = os.path.abspath(C.path('chrome'))
     if os.path.isfile(chrome):
@@ -141,18 +329,18 @@ def build_driver():
 
 def get_element(driver, ID, BUTTON=False):
     timeout = 20
-    exp_cond = ec.element_to_be_clickable((By.ID, ID)) if BUTTON \
-        else ec.presence_of_element_located((By.ID, ID))
+    exp_cond = ec.element_to_be_clickable((by.By.ID, ID)) if BUTTON \
+        else ec.presence_of_element_located((by.By.ID, ID))
 
     try:
-        wait = WebDriverWait(
+        wait = ui.WebDriverWait(
             driver,
             timeout,
             poll_frequency=0.1)
 
         element = wait.until(exp_cond)
 
-    except TimeoutException:
+    except exceptions.TimeoutException:
         print(u.error(), 'PAGE DID NOT LOAD IN TIME...')
 
     return element
@@ -176,6 +364,14 @@ def format_date(date):
 
 
 def save_data(data, date):
+    # the day's file is written once, every scrape is kept in the archive
+    # and the query store
+    regions = data['NEW_CASES_PER_DAY_REGIONS']
+    fhm_archive.add(regions, 'scraper')
+    fhm_store.add_days((
+        (d, fhm_store.C.SWEDEN if r == 'Totalt' else r, n, None)
+        for d, cells in regions.items() for r, n in cells.items()), 'scraper')
+
     create_dir()
     file = C.file(date)
     if not os.path.isfile(file):
@@ -237,7 +433,67 @@ class C:
     PAGINATION_ID = 'ember277'
     BUTTON_ID = 'ember282'
     TABLE_ID = 'ember284'
-    PARSER = 'html.parser'
+    NETWORK = '-n'
+    WORKERS_FLAG = '-w'
+    WORKERS = 1  # browsers paging at the same time, more with -w
+    FEATURE_SERVER = '/FeatureServer/'
+    QUERY = '/query'
+    TOTAL = 'Totalt_antal_fall'
+    CAPTURE_TIMEOUT = 20  # seconds
+    POLL = 0.5  # seconds between reads of the performance log
+    PAGE_TIMEOUT = 10  # seconds for a page to render
+    CLICKS = 10  # pages clicked through per script of a jump
+    SCRIPT_TIMEOUT = (CLICKS + 1) * PAGE_TIMEOUT
+    READ = '''
+        var read = function (table) {
+            var rows = table.getElementsByTagName('tr');
+            var cells = function (row) { return row.getElementsByTagName('td'); };
+            var page = {date: cells(rows[0])[1].textContent, rows: []};
+
+            for (var i = 1; i < rows.length; i++) {
+                page.rows.push([cells(rows[i])[0].textContent, cells(rows[i])[1].textContent]);
+            }
+
+            return page;
+        };
+    '''
+    READ_TABLE = READ + 'return read(arguments[0]);'
+    # arguments: table, button, clicks, timeout in ms and the callback. The
+    # observer is in place before each click, a click waits for the changes
+    # of the previous one to settle, i.e. a task without new mutations.
+    NEXT_PAGE = READ + '''
+        var table = arguments[0], button = arguments[1], clicks = arguments[2];
+        var timeout = arguments[3], done = arguments[arguments.length - 1];
+        var timer, settle;
+
+        var finish = function (page) {
+            observer.disconnect();
+            clearTimeout(timer);
+            clearTimeout(settle);
+            done(page);
+        };
+        var next = function () {
+            if (clicks-- === 0) {
+                return finish(read(table));
+            }
+
+            clearTimeout(timer);
+            timer = setTimeout(function () { finish(null); }, timeout);
+            button.click();
+        };
+        var observer = new MutationObserver(function () {
+            clearTimeout(timer);
+            clearTimeout(settle);
+            settle = setTimeout(next, 0);
+        });
+
+        observer.observe(table, {childList: true, subtree: true, characterData: true});
+        next();
+    '''
+
+    USAGE = 'Usage: ./fhm_scraper.py [-n] [-w WORKERS]\n' \
+        '\n-n: Read the dashboard\'s query responses instead of paging' \
+        '\n-w WORKERS: Browsers paging at the same time, 1 by default'
 
     @staticmethod
     def file(date=None):
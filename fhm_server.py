@@ -0,0 +1,164 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import urlparse, unquote
+from sys import argv
+import utils as u
+import time
+import json
+import fhm
+
+
+# Keeps parsed layers in memory, refreshes them in the background and answers
+# the fhm.py queries as JSON, e.g. ./fhm.py 1 4 Västra Götaland:
+#   $ ./fhm_server.py 8080 &
+#   $ curl http://127.0.0.1:8080/1/4/Västra%20Götaland
+def main():
+    port = int(argv[1]) if len(argv) > 1 else C.PORT
+    interval = int(argv[2]) if len(argv) > 2 else C.INTERVAL
+
+    print(u.debug(), 'LOADING LAYERS...')
+    refresh()
+    Thread(target=refresh_loop, args=(interval,), daemon=True).start()
+
+    server = ThreadingHTTPServer((C.HOST, port), handler)
+    server.daemon_threads = True
+    print(u.info(), 'SERVING ON http://{}:{}/'.format(C.HOST, port))
+
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+class cache:
+    # layers are swapped as a whole on refresh, responses are rendered once
+    layers = {}
+    responses = {}
+    updated = None
+    lock = Lock()
+
+
+class handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        responses = cache.responses  # dropped as a whole by a refresh
+        res = responses.get(path)
+
+        if res is None:
+            res = respond(path)
+            if len(responses) < C.MAX_RESPONSES:
+                with cache.lock:
+                    responses[path] = res
+
+        status, body = res
+        self.send_response(status)
+        self.send_header('Content-Type', C.JSON)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def respond(path):
+    try:
+        p0, p1, p2 = get_params(path)
+
+    except ValueError:
+        return 400, dumps({'error': C.USAGE})
+
+    key = (p0, p0 == 1 and p1 in fhm.C.DEATHS_MODES)  # p1 sorts layers 0 and 4
+    if p0 == 2 or key not in cache.layers:
+        return 404, dumps({'error': 'NO DATA'})
+
+    data = cache.layers[key]
+    if p0 == 1 and p1 in fhm.C.REGION_MODES and not fhm.has_region(data, p2):
+        return 404, dumps({'error': 'NO SUCH REGION'})
+
+    return 200, dumps(OrderedDict([
+        ('updated', cache.updated),
+        ('data', fhm.build(data, p0, p1, p2))]))
+
+
+def get_params(path):
+    # /p0[/p1[/p2]], as the ./fhm.py arguments
+    params = [unquote(p) for p in path.strip('/').split('/', 2) if p]
+    if not params:
+        raise ValueError
+
+    p0 = int(params[0])
+    p1 = int(params[1]) if len(params) > 1 else None
+    p2 = params[2].title() if len(params) > 2 else None
+
+    if p0 not in fhm.api.LAYERS + [2] or (p0 == 1 and p1 is None):
+        raise ValueError
+
+    return p0, p1, p2
+
+
+def refresh():
+    session = fhm.get_session(len(fhm.api.LAYERS))
+
+    def fetch(n):
+        try:
+            jdata = fhm.record(fhm.get_data(fhm.api.url(n), session), n)
+            jdata['features'] = list(jdata['features'])
+
+        except fhm.FetchError as e:
+            print(u.error(), e)
+            return []
+
+        if n != 1:
+            return [((n, False), fhm.parse_layer(n, jdata))]
+
+        return [((n, DEATHS), fhm.parse_layer(n, jdata, DEATHS))
+                for DEATHS in (False, True)]
+
+    with ThreadPoolExecutor(max_workers=len(fhm.api.LAYERS)) as executor:
+        layers = dict(l for ls in executor.map(fetch, fhm.api.LAYERS) for l in ls)
+
+    merged = dict(cache.layers)
+    merged.update(layers)  # a failed layer keeps its last data
+
+    with cache.lock:
+        cache.layers = merged
+        cache.updated = time.strftime('%y-%m-%d %H:%M:%S')
+        cache.responses = {}
+
+
+def refresh_loop(interval):
+    while True:
+        time.sleep(interval)
+
+        try:
+            refresh()
+
+        except Exception as e:
+            print(u.error(), 'REFRESH FAILED:', e)
+
+
+def dumps(jdata):
+    return json.dumps(jdata, ensure_ascii=False).encode('utf-8')
+
+
+class C:
+    HOST = '127.0.0.1'
+    PORT = 8080
+    INTERVAL = 300  # seconds between refreshes
+    MAX_RESPONSES = 10000  # rendered responses kept until the next refresh
+    JSON = 'application/json; charset=utf-8'
+    USAGE = 'GET /p0[/p1[/p2]], as ./fhm.py p0 [p1] [p2]'
+
+
+if __name__ == "__main__":
+    main()
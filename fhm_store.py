@@ -0,0 +1,228 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from datetime import date
+from sys import argv
+import utils as u
+import sqlite3
+import fhm
+import sys
+import os
+
+
+# Query store of the fetched layers in data/fhm.db, fed by fhm.py (layers 1, 3
+# and 4) and fhm_scraper.py. New cases and deaths per date and region (Sverige
+# for the whole country) are kept as revised, totals per age group and gender
+# once per day they are fetched, a group of them shows its latest fetch:
+#   $ ./fhm_store.py days --from 20-03-01 --region Stockholm,Skåne
+#   $ ./fhm_store.py days --group-by month,region
+#   $ ./fhm_store.py days --region Sverige --cumulative
+#   $ ./fhm_store.py age_groups --group-by age_group
+def main():
+    cumulative = fhm.get_flag(C.CUMULATIVE)
+    window = fhm.get_option(C.WINDOW)
+    start = fhm.get_option(C.FROM)
+    end = fhm.get_option(C.TO)
+    regions = fhm.get_option(C.REGION)
+    groups = fhm.get_option(C.GROUP_BY)
+    table = argv[1] if len(argv) > 1 else 'days'
+
+    try:
+        sql, params = build_query(
+            table, start, end,
+            None if regions is None else [r.strip().title() for r in regions.split(',')],
+            None if groups is None else groups.split(','),
+            0 if cumulative else None if window is None else int(window))
+
+    except (KeyError, ValueError):
+        print(C.USAGE)
+        quit()
+
+    with connect() as db:
+        cursor = db.execute(sql, params)
+        print_rows([d[0] for d in cursor.description], cursor.fetchall())
+
+
+def connect():
+    os.makedirs(os.path.dirname(C.DB), exist_ok=True)
+    db = sqlite3.connect(C.DB)
+    db.execute('PRAGMA journal_mode = WAL')  # readers do not block a writer
+    db.execute('PRAGMA synchronous = NORMAL')
+    db.executescript(C.SCHEMA)
+
+    return db
+
+
+def add_days(rows, source):
+    # (date, region, cases, deaths), a None keeps what is stored
+    try:
+        with connect() as db:
+            db.executemany(C.UPSERT_DAY, ((d, r, c, n, source) for d, r, c, n in rows))
+
+    except (sqlite3.Error, OSError) as e:  # a query never fails on the store
+        print(u.error(), 'NOT STORED:', e, file=sys.stderr)
+
+
+def add_totals(table, data, updated=None):
+    # {name: {Fall, Intensivvårdade, Avlidna}}, as parsed by fhm.parse_totals
+    updated = date.today().strftime('%y-%m-%d') if updated is None else updated
+    key = C.TABLES[table][1]
+
+    try:
+        with connect() as db:
+            db.executemany(
+                C.UPSERT_TOTAL.format(table, key),
+                ((updated, name, v.get('Fall'), v.get('Intensivvårdade'), v.get('Avlidna'))
+                 for name, v in data.items()))
+
+    except (sqlite3.Error, OSError) as e:
+        print(u.error(), 'NOT STORED:', e, file=sys.stderr)
+
+
+def build_query(table, start=None, end=None, regions=None, groups=None, window=None):
+    # window: None, 0 for cumulative or the number of rows of a rolling sum
+    time, key, values = C.TABLES[table]
+    groups = groups or [C.TIME, key]
+    if key == 'region' and C.SWEDEN not in (regions or []):
+        values = [v for v in values if v not in C.SWEDEN_ONLY]
+    columns = [C.GROUPS[g].format(time) if g in C.GROUPS else {key: key}[g]
+               for g in groups]
+
+    where, params = [], []
+    if start is not None:
+        where.append('{} >= ?'.format(time))
+        params.append(start)
+    if end is not None:
+        where.append('{} <= ?'.format(time))
+        params.append(end)
+    if regions is not None and key == 'region':
+        where.append('region IN ({})'.format(', '.join('?' * len(regions))))
+        params += regions
+    elif key == 'region':
+        where.append('region <> ?')  # the regions add up to Sverige
+        params.append(C.SWEDEN)
+
+    source = table
+    where = ' WHERE ' + ' AND '.join(where) if where else ''
+    if table in C.LATEST:
+        # totals up to each fetch, only the latest fetch of every group and
+        # time group counts
+        bucket = next((c for c, g in zip(columns, groups) if g in C.GROUPS), "''")
+        source = '(SELECT * FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY {}, {} ' \
+            'ORDER BY {} DESC) AS latest FROM {}{}) WHERE latest = 1)'.format(
+                bucket, key, time, table, where)
+        where = ''
+
+    sql = 'SELECT {}, {} FROM {}{} GROUP BY {} ORDER BY {}'.format(
+        ', '.join('{} AS {}'.format(c, g) for c, g in zip(columns, groups)),
+        ', '.join('SUM({0}) AS {0}'.format(v) for v in values),
+        source,
+        where,
+        ', '.join(groups),
+        ', '.join(groups))
+
+    if window is None:
+        return sql, params
+
+    order = [g for g in groups if g in C.GROUPS]
+    if not order:
+        raise ValueError('A window needs a time group')
+
+    partition = [g for g in groups if g not in C.GROUPS]
+    frame = 'UNBOUNDED PRECEDING' if window == 0 else '{} PRECEDING'.format(window - 1)
+
+    return 'SELECT {}, {} FROM ({}) WINDOW w AS ({}ORDER BY {} ROWS BETWEEN {} ' \
+        'AND CURRENT ROW) ORDER BY {}'.format(
+            ', '.join(groups),
+            ', '.join('SUM({0}) OVER w AS {0}'.format(v) for v in values),
+            sql,
+            'PARTITION BY {} '.format(', '.join(partition)) if partition else '',
+            ', '.join(order),
+            frame,
+            ', '.join(partition + order)), params
+
+
+def print_rows(names, rows):
+    rows = [['-' if v is None else str(v) for v in row] for row in rows]
+    widths = [max([len(n)] + [len(r[i]) for r in rows]) for i, n in enumerate(names)]
+    line = '  '.join('{{:{}{}}}'.format('<' if i == 0 else '>', w)
+                     for i, w in enumerate(widths))
+
+    print(line.format(*[n.upper() for n in names]))
+    for row in rows:
+        print(line.format(*row))
+
+
+class C:
+    DB = 'data/fhm.db'
+    SWEDEN = 'Sverige'
+    SWEDEN_ONLY = ['deaths']  # of days, per day for the whole country only
+    TIME = 'date'
+    FROM = '--from'
+    TO = '--to'
+    REGION = '--region'
+    GROUP_BY = '--group-by'
+    CUMULATIVE = '--cumulative'
+    WINDOW = '--window'
+    TABLES = {  # (time, key, values)
+        'days': ('date', 'region', ['cases', 'deaths']),
+        'age_groups': ('updated', 'age_group', ['cases', 'intensive_care', 'deaths']),
+        'genders': ('updated', 'gender', ['cases', 'intensive_care', 'deaths'])
+    }
+    LATEST = ['age_groups', 'genders']
+    GROUPS = {  # time groups, dates are YY-MM-DD
+        'date': '{}',
+        'week': "strftime('%Y-%W', '20' || {})",
+        'month': 'substr({}, 1, 5)',
+        'year': 'substr({}, 1, 2)'
+    }
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS days (
+            date TEXT NOT NULL,
+            region TEXT NOT NULL,
+            cases INTEGER,
+            deaths INTEGER,
+            source TEXT,
+            PRIMARY KEY (date, region));
+        CREATE INDEX IF NOT EXISTS days_region ON days (region, date);
+        CREATE TABLE IF NOT EXISTS age_groups (
+            updated TEXT NOT NULL,
+            age_group TEXT NOT NULL,
+            cases INTEGER,
+            intensive_care INTEGER,
+            deaths INTEGER,
+            PRIMARY KEY (updated, age_group));
+        CREATE INDEX IF NOT EXISTS age_groups_age_group ON age_groups (age_group, updated);
+        CREATE TABLE IF NOT EXISTS genders (
+            updated TEXT NOT NULL,
+            gender TEXT NOT NULL,
+            cases INTEGER,
+            intensive_care INTEGER,
+            deaths INTEGER,
+            PRIMARY KEY (updated, gender));
+        CREATE INDEX IF NOT EXISTS genders_gender ON genders (gender, updated);
+    '''
+    UPSERT_DAY = '''
+        INSERT INTO days (date, region, cases, deaths, source) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (date, region) DO UPDATE SET
+            cases = COALESCE(excluded.cases, cases),
+            deaths = COALESCE(excluded.deaths, deaths),
+            source = excluded.source
+    '''
+    UPSERT_TOTAL = '''
+        INSERT OR REPLACE INTO {} (updated, {}, cases, intensive_care, deaths)
+        VALUES (?, ?, ?, ?, ?)
+    '''
+    USAGE = 'Usage: ./fhm_store.py [days|age_groups|genders] [--from YY-MM-DD] ' \
+        '[--to YY-MM-DD] [--region REGION[,REGION..]] [--group-by GROUP[,GROUP..]] ' \
+        '[--cumulative | --window ROWS]\n' \
+        '\nGROUP: date, week, month, year (of the fetch for age_groups and genders,' \
+        ' the latest fetch in the group)' \
+        ' or region, age_group, gender' \
+        '\nDeaths per day are kept for Sverige only, --region Sverige' \
+        '\n--cumulative: Running sums over the time group, per other group' \
+        '\n--window ROWS: Rolling sums over the last ROWS of the time group'
+
+
+if __name__ == "__main__":
+    main()
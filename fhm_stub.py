@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from sys import argv
+import utils as u
+import fhm_pbf
+import hashlib
+import json
+import os
+import re
+
+
+# Local stand-in for the FeatureServer, answers fhm.py queries from
+# fixtures/layer-N.json:
+#   $ ./fhm_stub.py 8000 &
+#   $ FHM_URL=http://127.0.0.1:8000/ ./fhm.py 1 5
+def main():
+    port = int(argv[1]) if len(argv) > 1 else C.PORT
+    handler.max_records = int(argv[2]) if len(argv) > 2 else C.MAX_RECORDS
+
+    server = ThreadingHTTPServer((C.HOST, port), handler)
+    print(u.info(), 'SERVING {} ON http://{}:{}/'.format(C.DIR, C.HOST, port))
+
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+class handler(BaseHTTPRequestHandler):
+    max_records = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        m = re.match(r'^/(\d+)(/query)?/?$', url.path)
+        jdata = None if m is None else read_layer(int(m.group(1)))
+
+        if jdata is None:
+            self.send_json({'error': {'code': 400, 'message': 'Invalid URL'}})
+        elif m.group(2) is None:
+            self.send_json(OrderedDict([
+                ('fields', jdata['fields']),
+                ('editingInfo', {'lastEditDate': edit_date(int(m.group(1)))})]))
+        elif params.get('f') == 'pbf':
+            self.send_json(query(jdata, params, self.max_records), True)
+        else:
+            self.send_json(query(jdata, params, self.max_records))
+
+    def send_json(self, jdata, PBF=False):
+        body = fhm_pbf.encode(jdata) if PBF \
+            else json.dumps(jdata, ensure_ascii=False).encode('utf-8')
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', C.PBF if PBF else C.JSON)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        print(u.debug(), format % args)
+
+
+def query(jdata, params, max_records=None):
+    features = [f['attributes'] for f in jdata['features']]
+    features = [a for a in features if where(params.get('where'), a)]
+
+    if params.get('returnCountOnly') == 'true':
+        return {'count': len(features)}
+
+    if 'outStatistics' in params:
+        return statistics(
+            features,
+            json.loads(params['outStatistics']),
+            params.get('groupByFieldsForStatistics'))
+
+    if 'orderByFields' in params:
+        for field in reversed(params['orderByFields'].split(',')):
+            name, _, order = field.strip().partition(' ')
+            features.sort(key=lambda a: a[name], reverse=order.upper() == 'DESC')
+
+    offset = int(params.get('resultOffset', 0))
+    count = int(params.get('resultRecordCount', max_records or len(features)))
+    count = min(count, max_records or count)
+    page = features[offset:offset + count]
+
+    res = OrderedDict()
+    res['objectIdFieldName'] = jdata['objectIdFieldName']
+    res['fields'] = jdata['fields']
+    if offset + count < len(features):
+        res['exceededTransferLimit'] = True
+    res['features'] = [{'attributes': a} for a in page]
+
+    return res
+
+
+def where(clause, attributes):
+    # 1=1, <field> <op> '<text>' and <field> <op> TIMESTAMP '<date>'
+    m = re.match(r"^\s*(\w+)\s*(<>|>=|<=|=|>|<)\s*(TIMESTAMP\s*)?'([^']*)'\s*$",
+                 clause or '', re.UNICODE)
+    if m is None:
+        return True
+
+    field, op, timestamp, value = m.groups()
+    if timestamp:
+        dt = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+        value = int(dt.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+    v = attributes.get(field)
+    return {
+        '=': v == value,
+        '<>': v != value,
+        '>': v > value,
+        '<': v < value,
+        '>=': v >= value,
+        '<=': v <= value
+    }[op]
+
+
+def statistics(features, stats, group=None):
+    group = [] if not group else [g.strip() for g in group.split(',')]
+    groups = OrderedDict()
+
+    for a in features:
+        groups.setdefault(tuple(a[g] for g in group), []).append(a)
+
+    rows = []
+    for key, members in groups.items():
+        row = OrderedDict(zip(group, key))
+
+        for s in stats:
+            values = [a[s['onStatisticField']] for a in members]
+            values = [v for v in values if v is not None]
+            row[s['outStatisticFieldName']] = C.STATISTICS[s['statisticType']](values)
+
+        rows.append({'attributes': row})
+
+    fields = [{'name': g, 'type': 'esriFieldTypeString'} for g in group] + \
+        [{'name': s['outStatisticFieldName'], 'type': 'esriFieldTypeDouble'} for s in stats]
+
+    return OrderedDict([('fields', fields), ('features', rows)])
+
+
+def edit_date(n):
+    return int(os.path.getmtime(C.file(n)) * 1000)
+
+
+def read_layer(n):
+    file = C.file(n)
+    if not os.path.isfile(file):
+        return None
+
+    with open(file, 'r') as f:
+        return json.load(f, object_pairs_hook=OrderedDict)
+
+
+class C:
+    HOST = '127.0.0.1'
+    PORT = 8000
+    MAX_RECORDS = 2000  # FeatureServer default maxRecordCount
+    JSON = 'application/json; charset=utf-8'
+    PBF = 'application/x-protobuf'
+    DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+    STATISTICS = {
+        'sum': lambda v: sum(v),
+        'count': lambda v: len(v),
+        'min': lambda v: min(v) if v else None,
+        'max': lambda v: max(v) if v else None,
+        'avg': lambda v: sum(v) / len(v) if v else None
+    }
+
+    @staticmethod
+    def file(n):
+        return os.path.join(C.DIR, 'layer-{}.json'.format(n))
+
+
+if __name__ == "__main__":
+    main()
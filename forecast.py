@@ -2,16 +2,15 @@
 # -*- coding: utf-8 -*-
 
 import fhm
-import numpy
 import utils as u
-from scipy.optimize import curve_fit
 from datetime import datetime, timedelta
-try:
-    import matplotlib.ticker as ticker
-    import matplotlib.pyplot as plt
-    import matplotlib.dates as mdate
-except ImportError:
-    pass
+
+# imported on first use, the table is printed before matplotlib loads
+numpy = u.lazy('numpy')
+optimize = u.lazy('scipy.optimize')
+ticker = u.lazy('matplotlib.ticker')
+plt = u.lazy('matplotlib.pyplot')
+mdate = u.lazy('matplotlib.dates')
 
 
 ndays = 7  # ndays forecast
@@ -19,13 +18,17 @@ ndays = 7  # ndays forecast
 
 def main():
     url = fhm.api.url(1)
-    raw = fhm.get_data(url)
-    data = fhm.parse_regions(raw)
-    progress = fhm.build_progress(data)
+    try:
+        raw = fhm.get_data(url)
+        data = fhm.parse_regions(raw)
+
+    except fhm.FetchError as e:
+        print(u.error(), e)
+        quit()
 
     # Get everything for plot & print
-    dates = list(progress.keys())
-    xarr, yarr = build_func_data(progress)
+    dates = data.dates
+    xarr, yarr = build_func_data(data)
     a, k_e, b, L, k_l, x0 = get_functions(xarr, yarr)
     B = 0  # b  # b-value in exp function
 
@@ -137,7 +140,7 @@ def fit_curve(func, xarr, yarr, p01):
     # Always explicitly supply own initial guesses.
 
     # Use maxfev to set a high number of iterations to assure it will converge.
-    popt, pcov = curve_fit(
+    popt, pcov = optimize.curve_fit(
         func,
         xarr,
         yarr,
@@ -148,12 +151,8 @@ def fit_curve(func, xarr, yarr, p01):
 
 
 def build_func_data(data):
-    xarr, yarr = [], []
-
-    for x, v in enumerate(data.values()):
-        y = int(v)
-        yarr.append(y)
-        xarr.append(x)
+    yarr = data.totals().cumsum()
+    xarr = numpy.arange(len(yarr))
 
     return xarr, yarr
 
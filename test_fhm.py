@@ -0,0 +1,86 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy
+import json
+import fhm
+import os
+
+
+# Runs against the fixtures, without a server:
+#   $ python -m unittest test_fhm
+class test_metrics(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(C.DIR, 'fixtures', 'layer-1.json'), 'r') as f:
+            self.data = fhm.parse_regions(json.load(f))
+
+    def head(self, n):
+        return fhm.series(self.data.dates[:n], self.data.regions, self.data.matrix[:n])
+
+    def test_short_history(self):
+        for n in (1, 5, 6):
+            m = fhm.metrics(self.head(n))
+            for name in ('average', 'incidence', 'growth'):
+                self.assertEqual(m.column(name), [None] * n)
+
+    def test_partial_windows(self):
+        m = fhm.metrics(self.head(15))
+        totals = self.data.totals()
+
+        self.assertEqual(m.column('average')[:6], [None] * 6)
+        self.assertEqual(m.column('average')[6], round(totals[:7].sum() / 7, 1))
+        self.assertEqual(m.column('growth')[:13], [None] * 13)
+        self.assertEqual(
+            m.column('growth')[13],
+            round((totals[7:14].sum() / totals[:7].sum() - 1) * 100, 1))
+
+    def test_append(self):
+        for n in (0, 3, 10):
+            m = fhm.metrics(self.head(n))
+            for i in range(n, len(self.data.dates)):
+                m.append(self.data.dates[i], self.data.matrix[i])
+
+            full = fhm.metrics(self.data)
+            self.assertEqual(m.dates, full.dates)
+            for name in ('average', 'incidence', 'growth'):
+                numpy.testing.assert_allclose(
+                    getattr(m, name), getattr(full, name), equal_nan=True)
+
+
+class test_pbf(unittest.TestCase):
+    URL = 'https://example.com/query?f=pbf'
+
+    def test_fixture(self):
+        # the first week of layer-1.json as a FeatureCollectionPBuffer
+        with open(os.path.join(C.DIR, 'fixtures', 'layer-1.pbf'), 'rb') as f:
+            res = response(f.read())
+        with open(os.path.join(C.DIR, 'fixtures', 'layer-1.json'), 'r') as f:
+            jdata = json.load(f)
+
+        pdata = fhm.decode(self.URL, res)
+        self.assertEqual(pdata['objectIdFieldName'], jdata['objectIdFieldName'])
+        self.assertEqual(pdata['fields'], jdata['fields'])
+        self.assertEqual(pdata['features'], jdata['features'][:7])
+        self.assertTrue(pdata['exceededTransferLimit'])
+
+    def test_error_body(self):
+        res = response(b' {"error": {"code": 400, "message": "Invalid query"}}')
+
+        with self.assertRaises(fhm.FetchError) as e:
+            fhm.decode(self.URL, res)
+        self.assertFalse(fhm.fetcher.retryable(e.exception))
+
+
+class response:
+    def __init__(self, content):
+        self.content = content
+        self.text = content.decode('utf-8', 'replace')
+
+
+class C:
+    DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,9 @@
 #!/usr/bin/python3
 
+import importlib
+import os
+import sys
+
 
 def info():
     return color.green("[INFO]")
@@ -17,6 +21,18 @@ def warn():
     return color.yellow("[WARN]")
 
 
+class lazy:
+    # stands in for a module until its first attribute is used
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+
+    def __getattr__(self, attr):
+        value = getattr(importlib.import_module(self._name), attr)
+        self.__dict__[attr] = value
+
+        return value
+
+
 class color:
     GREEN = '\033[92m'
     RED = '\033[91m'
@@ -24,19 +40,25 @@ class color:
     BLUE = '\033[94m'
     DEFAULT = '\033[0m'
     BOLD = "\033[1m"
+    ENABLED = sys.stdout.isatty() and 'NO_COLOR' not in os.environ
 
     @staticmethod
     def green(output):
-        return color.GREEN + output + color.DEFAULT
+        return color.wrap(color.GREEN, output)
 
     @staticmethod
     def red(output):
-        return color.RED + str(output) + color.DEFAULT
+        return color.wrap(color.RED, str(output))
 
     @staticmethod
     def yellow(output):
-        return color.YELLOW + output + color.DEFAULT
+        return color.wrap(color.YELLOW, output)
 
     @staticmethod
     def blue(output):
-        return color.BLUE + output + color.DEFAULT
+        return color.wrap(color.BLUE, output)
+
+    @staticmethod
+    def wrap(code, output):
+        # no escape codes when piped
+        return code + output + color.DEFAULT if color.ENABLED else output